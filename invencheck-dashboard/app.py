@@ -312,7 +312,8 @@ if not recent_unknowns.empty:
     assign = st.sidebar.button("Assign ID", icon=":material/nfc:", type="primary", disabled=False if new_user_id else True)
 
     if assign and new_user_id:
-        supabase.table("users").update({"user_id": new_user_id}).eq("uid", selected_uid).execute()
+        # Touch the timestamp so devices pick the assignment up on their next delta sync
+        supabase.table("users").update({"user_id": new_user_id, "timestamp": datetime.now(pytz.UTC).isoformat()}).eq("uid", selected_uid).execute()
         st.sidebar.success(f"Updated UID {selected_uid} with User ID '{new_user_id}'")
         st.cache_data.clear()
         st.rerun()
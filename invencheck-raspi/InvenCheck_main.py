@@ -7,6 +7,8 @@ Damiano Milani
 """
 
 import os
+import sys
+import signal
 import time
 import threading
 import socket
@@ -14,15 +16,25 @@ import fcntl
 import struct
 import requests
 from datetime import datetime, timedelta
-from datetime import time as dt_time
-from email.utils import parsedate_to_datetime
 import pytz
 
 from dotenv import load_dotenv
 
-from buzzer import Buzzer
-from lcd import LCD
-from nfc import NFCReader
+import hal
+from sysmetrics import SystemSampler
+from nfc import DIRECTIONS, PollSchedule, parse_readers
+from outbox import Outbox
+from ledger import AttendanceLedger
+from roster import Roster, SingleFlight
+from supabase_client import SupabaseClient
+from timesync import TimeService
+from connectivity import ConnectivityMonitor, OFFLINE, ONLINE, DEGRADED
+from status_server import StatusServer
+from eventlog import EventLog, parse_level
+from tracing import TraceRecorder
+from pipeline import ScanEvent, Stage, ScanPipeline, ScanDebouncer
+import metrics
+from metrics import ThroughputMeter, LatencyWindow
 
 # === Load Configuration ===
 load_dotenv()
@@ -33,248 +45,473 @@ EMPLOYEES_TABLE = "users"
 DEVICES_TABLE = "devices"
 
 DEVICE_ID = socket.gethostname()
+HARDWARE = os.getenv("INVENCHECK_HARDWARE", hal.REAL)  # "real", or "sim" to run without pigpiod/I2C/SPI
+SIM_SCAN_SCRIPT = os.getenv("SIM_SCAN_SCRIPT")  # "offset uid" lines; random arrivals when unset
+SIM_SCAN_RATE = float(os.getenv("SIM_SCAN_RATE", "6"))  # Random arrivals per minute
+SIM_UIDS = [uid for uid in os.getenv("SIM_UIDS", ",".join(hal.SIM_UIDS)).split(",") if uid]
 BUZZER_PIN = 13
+NFC_IRQ_PIN = int(os.getenv("NFC_IRQ_PIN")) if os.getenv("NFC_IRQ_PIN") else None  # BCM pin wired to PN532 P32/IRQ
+NFC_SPI_BAUDRATE = int(os.getenv("NFC_SPI_BAUDRATE", "1000000"))  # PN532 supports up to 5 MHz
+NFC_MAX_RETRIES = int(os.getenv("NFC_MAX_RETRIES", "255"), 0)  # MxRtyPassiveActivation, 255 = retry forever
+NFC_PEAK_HOURS = os.getenv("NFC_PEAK_HOURS", "07:00-09:30,11:45-14:15,16:30-19:00")  # Continuous polling
+NFC_IDLE_INTERVAL = float(os.getenv("NFC_IDLE_INTERVAL", "0.3"))  # Seconds between status checks when quiet
+NFC_ACTIVE_HOLD = 120  # Keep polling continuously for this long after a scan
+# Several readers: "name:cs_pin:irq_pin:bus:direction,...", e.g. "entry:D8:25::in,exit:D7:24::out".
+# Rows keep DEVICE_ID (its devices row gives the place) and name the lane in attendance.lane (see
+# supabase_schema.sql). Unset means a single reader on D8 and NFC_IRQ_PIN.
+NFC_READERS = parse_readers(os.getenv("NFC_READERS")) or [
+    {"name": "", "cs_pin": "D8", "irq_pin": NFC_IRQ_PIN, "bus": "spi0", "direction": None}
+]
 DB_PING_INTERVAL = 1200  # Every 20 minutes
-CONN_CHECK_INTERVAL = 10 
+HEARTBEAT_TIMEOUT = (3, 5)  # Connect/read timeouts, the heartbeat must never hang
+CONN_IDLE_PROBE_INTERVAL = 60  # Probe Supabase only after this long without real traffic
+CONN_FAILURE_THRESHOLD = 3  # Consecutive failed requests before the circuit breaker opens
+CONN_SLOW_LATENCY = 1.5  # Median request time (s) above which the link is DEGRADED
+DATA_DIR = os.getenv("INVENCHECK_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+OUTBOX_PATH = os.path.join(DATA_DIR, "outbox.db")
+OUTBOX_BATCH_SIZE = 50  # Rows per attendance insert request
+OUTBOX_BATCH_DELAY = 0.5  # Seconds to let a burst accumulate before sending
+LEDGER_PATH = os.path.join(DATA_DIR, "ledger.json")
+ROSTER_PATH = os.path.join(DATA_DIR, "roster.json")
+LEDGER_SYNC_INTERVAL = 60  # Pull rows written by other devices every minute
+LEDGER_FULL_SYNC_INTERVAL = 900  # Re-read the whole day every 15 minutes
+LEDGER_SYNC_OVERLAP = 300  # Re-read the last 5 minutes to catch late inserts
+LEDGER_PAGE_SIZE = 1000  # Rows per prefetch request; Supabase caps responses at max-rows (1000 by default)
+DEBOUNCE_WINDOW = float(os.getenv("DEBOUNCE_WINDOW", "3"))  # Same tag read again within this many seconds is a re-read
+DEBOUNCE_MODE = os.getenv("DEBOUNCE_MODE", "suppress")  # "suppress" silently, or "ack" by showing the last result again
+DEBOUNCE_BUFFER = 32
+METRICS_REPORT_INTERVAL = 300  # Also dumps the per-stage latency histograms
+ROSTER_SYNC_INTERVAL = int(os.getenv("ROSTER_SYNC_INTERVAL", "120"))  # Delta sync of the users table
+ROSTER_WATERMARK_COLUMN = os.getenv("ROSTER_WATERMARK_COLUMN", "timestamp")
+ROSTER_SYNC_OVERLAP = 60  # Seconds of overlap on the watermark to absorb clock skew between writers
+UNKNOWN_TAG_TTL = 60  # Trust a cached "Unknown" answer for this long before asking Supabase again
+STATUS_PORT = int(os.getenv("STATUS_PORT", "0"))  # LAN /metrics and /status endpoint, 0 disables it
+STATUS_BIND = os.getenv("STATUS_BIND", "0.0.0.0")
+LOG_LEVEL = parse_level(os.getenv("LOG_LEVEL"))  # DEBUG, INFO, WARN or ERROR
+LOG_SCAN_LEVEL = parse_level(os.getenv("LOG_SCAN_LEVEL"))  # Hot path (scan/nfc/perf channels)
+LOG_FILE = os.getenv("LOG_FILE")  # Rotated log file; unset logs to journald through stdout
+LOG_FLUSH_INTERVAL = 1.0
+SCAN_TRACE_PATH = os.getenv("SCAN_TRACE_PATH")  # JSONL scan trace for replay benchmarks; unset disables it
+
+# Initialize structured logger
+log = EventLog(
+    level=LOG_LEVEL,
+    channel_levels={"scan": LOG_SCAN_LEVEL, "nfc": LOG_SCAN_LEVEL, "perf": LOG_SCAN_LEVEL},
+    flush_interval=LOG_FLUSH_INTERVAL,
+    path=LOG_FILE,
+)
 
 # Initialize Buzzer
-buzzer = Buzzer(BUZZER_PIN)
+buzzer = hal.create_buzzer(HARDWARE, BUZZER_PIN)
 
 # Initialize LCD (SPI)
-lcd = LCD()
+sampler = SystemSampler(log=log)
+lcd = hal.create_lcd(HARDWARE, sampler)
 
-# Initialize NFC Reader (I2C)
-nfc = NFCReader()
+# Initialize NFC Readers (SPI), one polling thread each
+def simulated_arrivals(index):
+    # The scan script drives the first reader, every reader gets its own random arrivals otherwise
+    if HARDWARE != hal.SIMULATED or (SIM_SCAN_SCRIPT and index > 0):
+        return None
+    return hal.simulated_arrivals(SIM_SCAN_SCRIPT, SIM_SCAN_RATE, SIM_UIDS, seed=index if index else None)
+
+nfc_readers = [
+    hal.create_nfc(
+        HARDWARE,
+        arrivals=simulated_arrivals(index),
+        spi_baudrate=NFC_SPI_BAUDRATE,
+        max_retries=NFC_MAX_RETRIES,
+        schedule=PollSchedule(PollSchedule.parse(NFC_PEAK_HOURS), NFC_IDLE_INTERVAL, NFC_ACTIVE_HOLD),
+        **options,
+    )
+    for index, options in enumerate(NFC_READERS)
+]
+
+# === Supabase REST Client ===
+supabase = SupabaseClient(SUPABASE_URL, SUPABASE_API_KEY)
+
+# === Offline Outbox ===
+attendance_lane_column = True  # False once attendance.lane is known to be missing (see supabase_schema.sql)
+attendance_client_id_column = True  # False once attendance.client_id is known to be missing
+attendance_upsert = True  # False once attendance.client_id is known to have no unique constraint
+
+def send_attendance(payloads):
+    """
+    Upsert the rows on their outbox client_id and skip those already stored, so
+    that a batch retried after a lost response is not inserted twice. Projects
+    without the supabase_schema.sql migration get plain inserts, without lane.
+    """
+    global attendance_lane_column, attendance_client_id_column, attendance_upsert
+    dropped = {column for column, present in (("lane", attendance_lane_column), ("client_id", attendance_client_id_column))
+               if not present}
+    if dropped:
+        payloads = [{key: value for key, value in payload.items() if key not in dropped} for payload in payloads]
+    # A JSON array is inserted by PostgREST in a single transaction
+    with metrics.timed("insert"):
+        if attendance_client_id_column and attendance_upsert:
+            response = supabase.upsert(ATTENDANCE_TABLE, payloads, on_conflict="client_id", ignore_duplicates=True)
+        else:
+            response = supabase.insert(ATTENDANCE_TABLE, payloads)
+    if response.status_code in (200, 201):
+        return True
+    code = supabase.error_code(response) if response.status_code >= 400 else None
+    if code == "PGRST204":  # Unknown column, named in the message
+        if attendance_client_id_column and "'client_id'" in response.text:
+            log.warn("db", "attendance.client_id is missing, retried batches may insert duplicates")
+            attendance_client_id_column = False
+            return send_attendance(payloads)
+        if attendance_lane_column and "'lane'" in response.text:
+            log.warn("db", "attendance.lane is missing, sending rows without their lane")
+            attendance_lane_column = False
+            return send_attendance(payloads)
+    if code == "42P10" and attendance_client_id_column and attendance_upsert:  # No unique constraint on client_id
+        log.warn("db", "attendance.client_id is not unique, falling back to plain inserts")
+        attendance_upsert = False
+        return send_attendance(payloads)
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()  # Server-side trouble: retry the whole batch later
+    log.error("db", "Supabase rejected attendance rows", rows=len(payloads), response=response.text)
+    return False
+
+os.makedirs(DATA_DIR, exist_ok=True)
+tracer = TraceRecorder(SCAN_TRACE_PATH, log=log) if SCAN_TRACE_PATH else None
+outbox = Outbox(OUTBOX_PATH, send_attendance, batch_size=OUTBOX_BATCH_SIZE, batch_delay=OUTBOX_BATCH_DELAY, log=log)
 
-# === API Headers ===
-HEADERS = {
-    "apikey": SUPABASE_API_KEY,
-    "Authorization": f"Bearer {SUPABASE_API_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=representation"
-}
+# === Attendance Ledger ===
+ledger = AttendanceLedger(LEDGER_PATH, log=log)
+# ledger.json can be older than the last scans after a power cut: those still in the outbox are replayed
+for payload in outbox.pending():
+    ledger.record(payload["user_id"], payload["action"], payload["timestamp"])
 
 # === In-Memory Cache ===
-employee_cache = {}
+roster = Roster(ROSTER_PATH, ROSTER_WATERMARK_COLUMN, log=log)
+uid_lookups = SingleFlight()
 
 last_uid_scanned = None
 repeat_count = 0
 xmas_count = 0
+last_heartbeat = None  # time.time() of the last heartbeat accepted by Supabase
+heartbeat_telemetry_column = True  # False once devices.telemetry is known to be missing (see supabase_schema.sql)
+heartbeat_upsert = True  # False once devices.device_id is known to have no unique constraint
+started_at = time.time()
 
-TIME_TOLERANCE_SECONDS = 30  # Accept local time if within 30 seconds of server
-time_offset_seconds = 0.0
-time_offset_lock = threading.Lock()
-
-
-def refresh_time_offset_from_server():
-    global time_offset_seconds
-    try:
-        response = requests.get(f"{SUPABASE_URL}/rest/v1/", headers=HEADERS, timeout=3)
-        date_header = response.headers.get("Date")
-        if not date_header:
-            return False
-
-        server_dt = parsedate_to_datetime(date_header)
-        if server_dt is None:
-            return False
-
-        server_utc = server_dt.astimezone(pytz.utc).replace(tzinfo=None)
-        local_utc = datetime.utcnow()
-        offset = (server_utc - local_utc).total_seconds()
-
-        with time_offset_lock:
-            time_offset_seconds = offset
-
-        if abs(offset) > TIME_TOLERANCE_SECONDS:
-            print(f"[TIME] Clock offset detected: {offset:.2f}s (using server time)")
-        else:
-            print(f"[TIME] Clock offset: {offset:.2f}s (within tolerance)")
-        return True
-    except Exception as e:
-        print(f"[WARN] Failed to refresh server time offset: {e}")
-        return False
+def probe_supabase(timeout, bypass_gate=False):
+    # Headers only, for a one-row select: the smallest request PostgREST answers from the database
+    return supabase.request("HEAD", DEVICES_TABLE, params={"select": "device_id", "limit": 1},
+                            timeout=timeout, bypass_gate=bypass_gate)
 
+# === Time Service ===
+TIME_TOLERANCE_SECONDS = 30  # Accept local time if within 30 seconds of server
+TIME_SYNC_INTERVAL = 600
 
-def local_time_is_sane():
-    with time_offset_lock:
-        offset = abs(time_offset_seconds)
-    return offset <= TIME_TOLERANCE_SECONDS
+timesvc = TimeService(
+    probe=lambda: probe_supabase(timeout=3),
+    interval=TIME_SYNC_INTERVAL,
+    tolerance=TIME_TOLERANCE_SECONDS,
+    log=log,
+)
+# Every Supabase response carries a Date header: use it as a free clock sample
+supabase.response_hooks.append(lambda start, end, response: timesvc.observe(start, end, response.headers.get("Date")))
 
 
 def now_utc_iso():
-    # Refresh offset on demand if local time is not within tolerance
-    if not local_time_is_sane():
-        refresh_time_offset_from_server()
-
-    with time_offset_lock:
-        offset = time_offset_seconds
-
-    return (datetime.utcnow() + timedelta(seconds=offset)).isoformat()
+    return timesvc.now_utc_iso()
+
+# === Connectivity ===
+def on_connectivity_change(previous, state):
+    log.warn("net", "Connectivity changed", previous=previous, state=state)
+    if state == OFFLINE:
+        lcd.show_message(["SYSTEM OFFLINE", "", "No internet/network", "Check WiFi config"])
+
+connectivity = ConnectivityMonitor(
+    probe=lambda: probe_supabase(timeout=2, bypass_gate=True),
+    failure_threshold=CONN_FAILURE_THRESHOLD,
+    idle_interval=CONN_IDLE_PROBE_INTERVAL,
+    slow_latency=CONN_SLOW_LATENCY,
+    on_change=on_connectivity_change,
+    log=log,
+)
+# Real request outcomes drive the state; while the breaker is open requests fail
+# immediately with a ConnectionError instead of waiting for their timeout.
+supabase.response_hooks.append(connectivity.on_response)
+supabase.error_hooks.append(connectivity.on_error)
+supabase.gate = connectivity.check
 
 # === NFC Logic ===
 def load_all_employees():
-    print("[DB] Loading all employees from Supabase...")
-    url = f"{SUPABASE_URL}/rest/v1/{EMPLOYEES_TABLE}?select=uid,user_id"
+    log.info("roster", "Loading all employees from Supabase")
     try:
-        response = requests.get(url, headers=HEADERS, timeout=5)
+        response = supabase.select(EMPLOYEES_TABLE, f"uid,user_id,{ROSTER_WATERMARK_COLUMN}")
         if response.status_code == 200:
-            for employee in response.json():
-                employee_cache[str(employee["uid"])] = employee
-            print(f"[DB] Loaded {len(employee_cache)} employees into cache.")
+            roster.replace_all(response.json())
+            log.info("roster", "Employees loaded into cache", count=len(roster))
+            return True
         else:
-            print(f"[ERROR] Failed to load employee list: {response.text}")
+            log.error("roster", "Failed to load employee list", response=response.text)
     except Exception as e:
-        print(f"[ERROR] Exception while loading employees: {e}")
+        log.error("roster", "Exception while loading employees", error=e)
+    return False
+
+def sync_employees_delta():
+    if roster.watermark is None:
+        return load_all_employees()
+    since = datetime.fromisoformat(roster.watermark.replace("Z", "+00:00")) - timedelta(seconds=ROSTER_SYNC_OVERLAP)
+    try:
+        response = supabase.select(
+            EMPLOYEES_TABLE, f"uid,user_id,{ROSTER_WATERMARK_COLUMN}",
+            {ROSTER_WATERMARK_COLUMN: f"gt.{since.isoformat()}"}
+        )
+        if response.status_code == 200:
+            rows = response.json()
+            roster.merge(rows)
+            if rows:
+                log.info("roster", "Roster delta sync", changed=len(rows))
+            return True
+        log.error("roster", "Roster delta sync failed", response=response.text)
+    except Exception as e:
+        log.warn("roster", "Roster delta sync error", error=e)
+    return False
+
+def roster_sync_loop():
+    while True:
+        time.sleep(ROSTER_SYNC_INTERVAL)
+        sync_employees_delta()
+        try:
+            roster.save()  # Rows cached by lookups since the last sync
+        except OSError as e:
+            log.warn("roster", "Failed to save roster", error=e)
 
 def delete_unknown_employees():
-    print("[DB] Cleaning unknown tags from remote database...")
-    url = f"{SUPABASE_URL}/rest/v1/{EMPLOYEES_TABLE}?user_id=eq.Unknown"
+    log.info("roster", "Cleaning unknown tags from remote database")
     try:
-        response = requests.delete(url, headers=HEADERS, timeout=5)
+        response = supabase.delete(EMPLOYEES_TABLE, {"user_id": "eq.Unknown"})
         if response.status_code in (200, 204):
-            print("[DB] Unknown employees removed from Supabase.")
+            log.info("roster", "Unknown employees removed from Supabase")
         else:
-            print(f"[ERROR] Failed to delete unknown employees: {response.text}")
+            log.error("roster", "Failed to delete unknown employees", response=response.text)
     except Exception as e:
-        print(f"[ERROR] Exception during unknown employee cleanup: {e}")
+        log.error("roster", "Exception during unknown employee cleanup", error=e)
 
 def nightly_employee_refresh():
     while True:
         now = datetime.now()
         next_run = now.replace(hour=4, minute=0, second=0, microsecond=0)
         if now >= next_run:
-            next_run = next_run.replace(day=now.day + 1)
+            next_run += timedelta(days=1)
         sleep_duration = (next_run - now).total_seconds()
-        print(f"[INFO] Next employee cache refresh in {sleep_duration / 3600:.2f} hours.")
+        log.info("roster", "Next employee cache refresh scheduled", hours=round(sleep_duration / 3600, 2))
         time.sleep(sleep_duration)
         delete_unknown_employees()
         load_all_employees()
 
 def get_employee_by_uid(uid):
-    uid_str = str(uid)
-    if uid_str in employee_cache:
-        print(f"[INFO] Tag UID {uid} already in local cache.")
-        if employee_cache[uid_str]["user_id"] == "Unknown":
-            print(f"[INFO] Tag UID {uid} is in local cache but Unknown, check if database has been updated.")
-        else:
-            return employee_cache[uid_str]
-
-    print(f"[DB] Tag UID {uid} not found in cache. Checking remote database...")
-    url = f"{SUPABASE_URL}/rest/v1/{EMPLOYEES_TABLE}?uid=eq.{uid}"
+    cached = roster.get(uid)
+    if cached:
+        log.debug("scan", "Tag UID in local cache", uid=uid)
+        if cached["user_id"] != "Unknown" or roster.is_known_unknown(uid):
+            metrics.increment("roster_hits")
+            return cached
+        log.debug("scan", "Tag UID cached as Unknown, checking database", uid=uid)
+
+    metrics.increment("roster_misses")
+    # Concurrent scans of the same tag share a single request
+    return uid_lookups.do(str(uid), lambda: fetch_employee(uid, cached))
+
+def fetch_employee(uid, cached=None):
+    log.debug("scan", "Tag UID not in cache, checking remote database", uid=uid)
     try:
-        response = requests.get(url, headers=HEADERS, timeout=5)
+        response = supabase.select(EMPLOYEES_TABLE, "uid,user_id", {"uid": f"eq.{uid}"})
         if response.status_code == 200:
             data = response.json()
             if data:
-                employee_cache[uid_str] = data[0]
-                print(f"[DB] UID {uid} fetched and cached.")
+                roster.put(data[0])
+                if data[0]["user_id"] == "Unknown":
+                    roster.mark_unknown(uid, UNKNOWN_TAG_TTL)
+                log.debug("scan", "Tag UID fetched and cached", uid=uid)
                 return data[0]
         else:
-            print(f"[ERROR] Failed to fetch UID {uid}: {response.text}")
+            log.error("db", "Failed to fetch tag UID", uid=uid, response=response.text)
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network error fetching UID {uid}: {e}")
+        log.error("db", "Network error fetching tag UID", uid=uid, error=e)
+        if cached:
+            return cached  # Offline: the last known state of the tag is the best answer
     return None
 
 def register_unknown_employee(uid):
-    print("[DB] Registering unknown tag UID...")
+    log.info("scan", "Registering unknown tag UID", uid=uid)
     payload = {"uid": str(uid), "user_id": "Unknown"}
     try:
-        response = requests.post(f"{SUPABASE_URL}/rest/v1/{EMPLOYEES_TABLE}", headers=HEADERS, json=payload, timeout=5)
+        response = supabase.insert(EMPLOYEES_TABLE, payload)
         if response.status_code in (200, 201):
-            print(f"[DB] Unknown employee with UID {uid} registered.")
-            employee_cache[str(uid)] = payload
+            log.info("scan", "Unknown tag UID registered", uid=uid)
+            roster.put(payload)
+            roster.mark_unknown(uid, UNKNOWN_TAG_TTL)
             return payload
         else:
-            print(f"[ERROR] Failed to register employee: {response.text}")
+            log.error("db", "Failed to register unknown tag UID", uid=uid, response=response.text)
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network error registering unknown UID {uid}: {e}")
+        log.error("db", "Network error registering unknown tag UID", uid=uid, error=e)
     return None
     
 def update_unknown_timestamp(uid):
-    print("[DB] Updating timestamp for unknown UID...")
+    log.debug("scan", "Updating timestamp for unknown tag UID", uid=uid)
     payload = {"timestamp": now_utc_iso()}
     try:
-        response = requests.patch(
-            f"{SUPABASE_URL}/rest/v1/{EMPLOYEES_TABLE}?uid=eq.{uid}&user_id=eq.Unknown",
-            headers=HEADERS,
-            json=payload,
-            timeout=5
-        )
+        response = supabase.update(EMPLOYEES_TABLE, {"uid": f"eq.{uid}", "user_id": "eq.Unknown"}, payload)
         if response.status_code in (200, 204):
-            print(f"[DB] Updated timestamp for unknown UID {uid}.")
+            log.debug("scan", "Updated timestamp for unknown tag UID", uid=uid)
         else:
-            print(f"[ERROR] Failed to update timestamp for unknown UID {uid}: {response.text}")
+            log.error("db", "Failed to update timestamp for unknown tag UID", uid=uid, response=response.text)
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network error updating timestamp for unknown UID {uid}: {e}")
+        log.error("db", "Network error updating timestamp for unknown tag UID", uid=uid, error=e)
 
 
 def get_today_cutoff_utc():
-    rome = pytz.timezone("Europe/Rome")
-    if not local_time_is_sane():
-        refresh_time_offset_from_server()
-
-    with time_offset_lock:
-        offset = time_offset_seconds
+    return timesvc.today_cutoff_utc()
+
+def fetch_latest_actions(since):
+    """
+    Latest attendance row of every user since the given timestamp, or None on failure.
+    Rows come by user and newest first, so the first row of a user is its latest.
+    Each page starts after the last user of the previous one: no offset to skip
+    on the server, and rows inserted meanwhile cannot shift a page boundary.
+    """
+    latest = {}
+    after = None
+    pages = 0
+    while True:
+        filters = {"timestamp": f"gte.{since}"}
+        if after is not None:
+            filters["user_id"] = f"gt.{after}"
+        response = supabase.select(
+            ATTENDANCE_TABLE, "user_id,action,timestamp", filters,
+            order="user_id.asc,timestamp.desc", limit=LEDGER_PAGE_SIZE, timeout=10
+        )
+        if response.status_code != 200:
+            log.error("ledger", "Failed to prefetch attendance", response=response.text)
+            return None
+        rows = response.json()
+        pages += 1
+        for row in rows:
+            latest.setdefault(row["user_id"], row)
+        if len(rows) < LEDGER_PAGE_SIZE:
+            break
+        after = rows[-1]["user_id"]
+    log.debug("ledger", "Attendance prefetched", users=len(latest), pages=pages)
+    return list(latest.values())
+
+def sync_ledger(full=False):
+    utc_cutoff = get_today_cutoff_utc()
+    if ledger.cutoff != utc_cutoff:
+        log.info("ledger", "New day, resetting attendance ledger")
+        ledger.reset(utc_cutoff)
+        full = True
+    since = utc_cutoff
+    if not full and ledger.watermark:
+        overlap = datetime.fromisoformat(ledger.watermark) - timedelta(seconds=LEDGER_SYNC_OVERLAP)
+        since = max(utc_cutoff, overlap.isoformat() + "Z")
+    try:
+        # Only the last action of each user matters to the ledger, in both the
+        # full seed and the delta since the watermark; both are paged.
+        rows = fetch_latest_actions(since)
+        if rows is None:
+            return False
+        ledger.apply_rows(rows, utc_cutoff, full=full)
+        if full:
+            log.info("ledger", "Ledger seeded", users=len(rows), since=utc_cutoff)
+        return True
+    except Exception as e:
+        log.warn("ledger", "Ledger sync error", error=e)
+    return False
 
-    local_now = datetime.utcnow() + timedelta(seconds=offset)
-    local_midnight = rome.localize(datetime.combine(local_now.astimezone(rome).date(), dt_time.min))
-    return local_midnight.astimezone(pytz.utc).isoformat().replace("+00:00", "Z")
+def ledger_sync_loop():
+    last_full = 0
+    while True:
+        full = not ledger.is_current(get_today_cutoff_utc()) or time.time() - last_full >= LEDGER_FULL_SYNC_INTERVAL
+        if sync_ledger(full=full) and full:
+            last_full = time.time()
+        try:
+            ledger.save()
+        except OSError as e:
+            log.warn("ledger", "Failed to save ledger", error=e)
+        time.sleep(LEDGER_SYNC_INTERVAL)
+
+def save_local_state():
+    """Write the ledger and roster changes not yet on disk (shutdown)."""
+    for name, store in (("ledger", ledger), ("roster", roster)):
+        try:
+            store.save()
+        except OSError as e:
+            log.warn(name, f"Failed to save {name}", error=e)
 
 def get_last_action_today(user_id):
-    print(f"[DB] Retrieving today's last action for {user_id}...")
     utc_cutoff = get_today_cutoff_utc()
-    url = (
-        f"{SUPABASE_URL}/rest/v1/{ATTENDANCE_TABLE}"
-        f"?user_id=eq.{user_id}&timestamp=gte.{utc_cutoff}"
-        f"&order=timestamp.desc&limit=1"
-    )
+    if ledger.is_current(utc_cutoff):
+        return ledger.last_action(user_id)
+
+    # Scans still waiting in the outbox are newer than anything on the server
+    pending = outbox.last_pending_action(user_id, utc_cutoff)
+    if pending:
+        log.debug("scan", "Last action found in outbox", user_id=user_id)
+        return pending
+
+    log.debug("scan", "Retrieving today's last action", user_id=user_id)
     try:
-        response = requests.get(url, headers=HEADERS, timeout=5)
+        response = supabase.select(
+            ATTENDANCE_TABLE, "action",
+            {"user_id": f"eq.{user_id}", "timestamp": f"gte.{utc_cutoff}"},
+            order="timestamp.desc", limit=1
+        )
         if response.status_code == 200:
             data = response.json()
-            print("[DB] Last action correctly retrieved.")
+            log.debug("scan", "Last action retrieved", user_id=user_id)
             return data[0]["action"] if data else None
         else:
-            print(f"[ERROR] Failed to query Supabase: {response.text}")
+            log.error("db", "Failed to query last action", user_id=user_id, response=response.text)
     except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network error querying last action for {user_id}: {e}")
-        raise
+        log.error("db", "Network error querying last action", user_id=user_id, error=e)
+        if ledger.cutoff != utc_cutoff:
+            raise
+        # Offline: the scans seen locally today are the best answer available
+        log.warn("scan", "Using local ledger, not yet synced with the server", user_id=user_id)
+        return ledger.last_action(user_id)
     return None
 
-def register_action(user_id, action, device_id):
-    print(f"[DB] Processing {action} for \"{user_id}\" at {device_id}")
+def register_action(user_id, action, device_id, timestamp=None, lane=None):
+    log.debug("scan", "Processing action", action=action, user_id=user_id, device_id=device_id, lane=lane)
     payload = {
         "user_id": user_id,
-        "timestamp": now_utc_iso(),
+        "timestamp": timestamp or now_utc_iso(),
         "action": action,
         "device_id": device_id
     }
-    try:
-        response = requests.post(f"{SUPABASE_URL}/rest/v1/{ATTENDANCE_TABLE}", headers=HEADERS, json=payload, timeout=5)
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Network error registering action for {user_id}: {e}")
-        lcd.show_message(["NETWORK ERROR", "Check connection", "Badge again later"])
-        buzzer.error()
-        return
-    if response.status_code in (200, 201):
-        now = datetime.now()
-        raspiside = "raspi01" in DEVICE_ID.lower()
-        in_arrow = "~" if raspiside else "⌂"
-        out_arrow = "⌂" if raspiside else "~"
-        if action == "check_in":
-            print(f"\033[32m[OK] {action.replace('_', ' ').upper()} recorded.\033[0m")
+    if lane:
+        payload["lane"] = lane
+    outbox.enqueue(payload)
+    return payload
+
+def show_action(user_id, action, reader=None):
+    now = datetime.now()
+    # The arrows depend on the side of the door the device is mounted on, except
+    # on a dedicated entry/exit lane where they always follow the lane direction
+    lane_direction = reader.direction if reader is not None else None
+    raspiside = "raspi01" in DEVICE_ID.lower() and not lane_direction
+    in_arrow = "~" if raspiside else "⌂"
+    out_arrow = "⌂" if raspiside else "~"
+    if action == "check_in":
+        log.info("scan", "Action recorded", action=action, user_id=user_id)
+        with metrics.timed("lcd"):
             lcd.show_message([user_id, "", f"{in_arrow*4}  CHECK-IN  {in_arrow*4}", now.strftime("%Y-%m-%d     %H:%M")])
+        with metrics.timed("buzzer"):
             buzzer.checkin()
-            check_xmas()
-        else:
-            print(f"\033[31m[OK] {action.replace('_', ' ').upper()} recorded.\033[0m")
+        check_xmas()
+    else:
+        log.info("scan", "Action recorded", action=action, user_id=user_id)
+        with metrics.timed("lcd"):
             lcd.show_message([user_id, "", f"{out_arrow*4}  CHECK-OUT  {out_arrow*3}", now.strftime("%Y-%m-%d     %H:%M")])
+        with metrics.timed("buzzer"):
             buzzer.checkout()
-    else:
-        print(f"[ERROR] Failed to write to Supabase: {response.text}")
-        lcd.show_message(["DB ERROR", "Try again"])
-        buzzer.error()
-        
+
 # === Uovo Handler ===
 def check_uovo(tag_uid):
     global last_uid_scanned, repeat_count
@@ -286,24 +523,36 @@ def check_uovo(tag_uid):
         )
 
         if globals()[_c] == 19:
-            print("[EGG] Sequence activated.")
-            msg1 = "".join([chr(c) for c in [87, 97, 107, 101, 32, 117, 112, 44, 32, 78, 101, 111, 46, 46, 46]])
-            msg2 = "".join([chr(c) for c in [84, 104, 101, 32, 77, 97, 116, 114, 105, 120, 32, 104, 97, 115, 32, 121, 111, 117, 46, 46]])
-            msg3 = "".join([chr(c) for c in [70, 111, 108, 108, 111, 119, 32, 116, 104, 101, 32, 119, 104, 105, 116, 101, 32, 32, 32, 32, 114, 97, 98, 98, 105, 116, 46]])
-            msg4 = "".join([chr(c) for c in [75, 110, 111, 99, 107, 44, 32, 107, 110, 111, 99, 107, 44, 32, 78, 101, 111, 46]])
-            lcd.show_message([msg1], duration=20)
-            buzzer.matrix1()
-            lcd.show_message([msg1, "", msg2], duration=20)
-            buzzer.matrix2()
-            lcd.show_message([msg3], duration=30)
-            buzzer.matrix3()
-            lcd.show_message([msg4], duration=30)
+            log.info("egg", "Sequence activated")
             globals()[_c] = 0
             return True
     except Exception as e:
-        print(f"[ERROR] {e}")
+        log.error("egg", "Sequence error", error=e)
     return False
 
+def show_uovo():
+    # The sequence waits on the songs for tens of seconds: keep it off the feedback stage
+    threading.Thread(target=play_uovo, name="egg", daemon=True).start()
+
+def play_uovo():
+    try:
+        msg1 = "".join([chr(c) for c in [87, 97, 107, 101, 32, 117, 112, 44, 32, 78, 101, 111, 46, 46, 46]])
+        msg2 = "".join([chr(c) for c in [84, 104, 101, 32, 77, 97, 116, 114, 105, 120, 32, 104, 97, 115, 32, 121, 111, 117, 46, 46]])
+        msg3 = "".join([chr(c) for c in [70, 111, 108, 108, 111, 119, 32, 116, 104, 101, 32, 119, 104, 105, 116, 101, 32, 32, 32, 32, 114, 97, 98, 98, 105, 116, 46]])
+        msg4 = "".join([chr(c) for c in [75, 110, 111, 99, 107, 44, 32, 107, 110, 111, 99, 107, 44, 32, 78, 101, 111, 46]])
+        lcd.show_message([msg1], duration=20)
+        buzzer.matrix1()
+        buzzer.wait()
+        lcd.show_message([msg1, "", msg2], duration=20)
+        buzzer.matrix2()
+        buzzer.wait()
+        lcd.show_message([msg3], duration=30)
+        buzzer.matrix3()
+        buzzer.wait()
+        lcd.show_message([msg4], duration=30)
+    except Exception as e:
+        log.error("egg", "Sequence error", error=e)
+
 
 # === Xmas Handler ===
 def check_xmas():
@@ -313,7 +562,7 @@ def check_xmas():
         return False
     xmas_count += 1
     if xmas_count % 8 == 0:
-        print("[XMAS] Xmas jingle activated.")
+        log.info("egg", "Xmas jingle activated")
         buzzer.xmas()
         lcd.show_message(["  HAPPY HOLIDAYS!","      * * * *","    BUONE FESTE"], duration=10)
         return True
@@ -339,113 +588,323 @@ def get_wlan_ip():
     except Exception:
         return None
     
+def heartbeat_telemetry(previous_counters):
+    counters = metrics.counters()
+    delta = {key: counters.get(key, 0) - previous_counters.get(key, 0) for key in counters}
+    scans, p50, p95 = scan_latency.drain()
+    lookups = delta.get("roster_hits", 0) + delta.get("roster_misses", 0)
+    telemetry = {
+        "net": connectivity.state,
+        "outbox": outbox.depth(),
+        "scans": scans,
+        "p50_ms": round(p50 * 1000) if p50 is not None else None,
+        "p95_ms": round(p95 * 1000) if p95 is not None else None,
+        "hit_rate": round(delta.get("roster_hits", 0) / lookups, 3) if lookups else None,
+    }
+    return telemetry, counters
+
+def send_heartbeat(payload):
+    """
+    Upsert the devices row. Projects without the supabase_schema.sql migration
+    get the heartbeat without telemetry, and by update then insert like before.
+    """
+    global heartbeat_telemetry_column, heartbeat_upsert
+    if not heartbeat_telemetry_column:
+        payload.pop("telemetry", None)
+    if heartbeat_upsert:
+        response = supabase.upsert(DEVICES_TABLE, payload, on_conflict="device_id", timeout=HEARTBEAT_TIMEOUT)
+    else:
+        values = {key: value for key, value in payload.items() if key != "device_id"}
+        response = supabase.update(DEVICES_TABLE, {"device_id": f"eq.{DEVICE_ID}"}, values,
+                                   returning=True, timeout=HEARTBEAT_TIMEOUT)
+        if response.status_code == 200 and not response.json():
+            response = supabase.insert(DEVICES_TABLE, payload, timeout=HEARTBEAT_TIMEOUT)
+
+    code = supabase.error_code(response) if response.status_code >= 400 else None
+    if code == "PGRST204" and "telemetry" in payload:  # Unknown column
+        log.warn("heartbeat", "devices.telemetry is missing, sending heartbeats without telemetry")
+        heartbeat_telemetry_column = False
+        return send_heartbeat(payload)
+    if code == "42P10" and heartbeat_upsert:  # No unique constraint matching on_conflict
+        log.warn("heartbeat", "devices.device_id is not unique, falling back to update then insert")
+        heartbeat_upsert = False
+        return send_heartbeat(payload)
+    return response
+
 def device_heartbeat():
+    global last_heartbeat
+    previous_counters = {}
     while True:
-        refresh_time_offset_from_server()
-        ip = get_wlan_ip()
+        telemetry, previous_counters = heartbeat_telemetry(previous_counters)
         payload = {
+            "device_id": DEVICE_ID,
             "timestamp": now_utc_iso(),
-            "ip": ip
+            "ip": get_wlan_ip(),
+            "telemetry": telemetry,
         }
         try:
-            response = requests.patch(
-                f"{SUPABASE_URL}/rest/v1/{DEVICES_TABLE}?device_id=eq.{DEVICE_ID}",
-                headers=HEADERS,
-                json=payload
-            )
-            if response.status_code == 404 or (response.status_code == 200 and not response.json()):
-                payload["device_id"] = DEVICE_ID
-                response = requests.post(f"{SUPABASE_URL}/rest/v1/{DEVICES_TABLE}", headers=HEADERS, json=payload)
-                if response.status_code not in (200, 201):
-                    print(f"[WARN] Failed to insert device: {response.text}")
-            elif response.status_code not in (200, 204):
-                print(f"[WARN] Heartbeat failed: {response.text}")
+            response = send_heartbeat(payload)
+            if response.status_code in (200, 201, 204):
+                last_heartbeat = time.time()
+            else:
+                log.warn("heartbeat", "Heartbeat failed", response=response.text)
         except Exception as e:
-            print(f"[WARN] Heartbeat error: {e}")
+            log.warn("heartbeat", "Heartbeat error", error=e)
         time.sleep(DB_PING_INTERVAL)
 
-# === Internet Monitor ===
-def has_internet():
-    try:
-        socket.setdefaulttimeout(1)
-        host = socket.gethostbyname("8.8.8.8")
-        s = socket.create_connection((host, 53), 2)
-        s.close()
-        return True
-    except:
-        return False
-    
-def internet_check():
-    while True:
-        if not has_internet():
-            print("[WARN] No internet connection!")
-            lcd.show_message(["SYSTEM OFFLINE", "", "No internet/network", "Check WiFi config"])
-            time.sleep(2)
-        else:
-            time.sleep(CONN_CHECK_INTERVAL)
-
-
-# === Main Loop ===
-def main_loop():
-    print("\033[1;36m**** TDK InvenCheck - NFC Attendance System ****\033[0m")
-    print("\033[1;36mdamiano.milani@tdk.com - 2025\033[0m")
-    
-    # Avoid blocking startup on remote DB fetch.
-    threading.Thread(target=load_all_employees, daemon=True).start()
-    threading.Thread(target=nightly_employee_refresh, daemon=True).start()
-    threading.Thread(target=device_heartbeat, daemon=True).start()
-    threading.Thread(target=internet_check, daemon=True).start()
-    buzzer.online()
 
+# === Scan Pipeline ===
+throughput = ThroughputMeter()
+scan_latency = LatencyWindow()
+debouncer = ScanDebouncer(DEBOUNCE_WINDOW, DEBOUNCE_BUFFER)
+
+def show_error(lines):
+    lcd.show_message(lines)
+    buzzer.error()
+
+def show_reading():
+    with metrics.timed("lcd"):
+        lcd.show_message(["***  InvenCheck  ***", "", "Tag detected!", "Reading database..."], duration=60)
+    with metrics.timed("buzzer"):
+        buzzer.read()
+
+def show_unknown():
+    lcd.show_message(["UNKNOWN TAG","","Please assign this  tag to someone first"])
+    buzzer.error()
+
+def show_diagnostic_mode():
+    lcd.show_message(["***  InvenCheck  ***","","DIAGNOSTIC MODE",""])
+    buzzer.sweep()
+    lcd.show_diagnostic(extra_screens=metrics.latency_screens() + log.screens(), on_done=buzzer.checkin)
+
+def decide_stage(event):
+    if check_uovo(event.uid):
+        event.feedback = show_uovo
+        event.outcome = "egg"
+        return event
+
+    fresh_unknown = roster.is_known_unknown(event.uid)
+    with event.timed("lookup"):
+        employee = get_employee_by_uid(event.uid)
+    if not employee:
+        employee = register_unknown_employee(event.uid)
+        if not employee:
+            event.feedback = lambda: show_error(["DB ERROR", "Try again"])
+            event.outcome = "db_error"
+            return event
+
+    if employee['user_id'] == "Unknown":
+        log.info("scan", "Unknown user", uid=event.uid)
+        if not fresh_unknown:
+            update_unknown_timestamp(event.uid) #renew timestamp (at most once per UNKNOWN_TAG_TTL)
+        event.feedback = show_unknown
+        event.outcome = "unknown"
+        return event
+
+    if employee['user_id'].lower() == "morpheus":
+        log.info("scan", "Diagnostic mode activated")
+        event.feedback = show_diagnostic_mode
+        event.outcome = "diagnostic"
+        return event
+
+    event.user_id = employee["user_id"]
+    direction = event.reader.direction if event.reader is not None else None
+    if direction:
+        event.action = DIRECTIONS[direction]  # Dedicated entry/exit lane
+    else:
+        with event.timed("last_act"):
+            last_action = get_last_action_today(event.user_id)
+        event.action = "check_out" if last_action == "check_in" else "check_in"
+    # Update the ledger right away so the next scan of the same user toggles
+    # correctly even while this one is still waiting in the persistence stage.
+    event.timestamp = now_utc_iso()
+    debouncer.set_action(event.uid, event.action)
+    ledger.record(event.user_id, event.action, event.timestamp)
+    return event
+
+def persist_stage(event):
+    if event.action:
+        try:
+            with event.timed("enqueue"):
+                register_action(event.user_id, event.action, DEVICE_ID, event.timestamp,
+                                lane=event.reader.name if event.reader is not None else None)
+            user_id, action, reader = event.user_id, event.action, event.reader
+            event.feedback = lambda: show_action(user_id, action, reader)
+            event.outcome = action
+        except Exception as e:
+            log.error("scan", "Failed to queue action", user_id=event.user_id, error=e)
+            event.feedback = lambda: show_error(["DB ERROR", "Try again"])
+            event.outcome = "db_error"
+    # The outbox row is the durable record of the scan; the ledger only gets marked
+    # dirty here and is written by the sync loop or on shutdown.
+    return event
+
+def feedback_stage(event):
+    if event.feedback:
+        with event.timed("feedback"):
+            event.feedback()
+    if event.final:
+        elapsed = time.monotonic() - event.detected_at
+        throughput.mark(event.detected_at)
+        scan_latency.add(elapsed)
+        metrics.observe("total", elapsed)
+        if tracer:
+            tracer.record(event.uid, event.detected_at, event.outcome, event.stages, elapsed)
+        log.debug("perf", "Scan handled", uid=event.uid, ms=round(elapsed * 1000))
+
+def on_stage_error(event, error):
+    if isinstance(error, requests.exceptions.RequestException):
+        event.feedback = lambda: show_error(["NETWORK ERROR", "Check connection", "Badge again later"])
+        event.outcome = "network_error"
+    else:
+        event.feedback = lambda: show_error(["ERROR", str(error)[:60]])
+        event.outcome = "error"
+    return event
+
+feedback = Stage("feedback", feedback_stage, on_error=lambda event, error: None, log=log)
+pipeline = ScanPipeline(
+    Stage("decide", decide_stage, on_error=on_stage_error, log=log),
+    Stage("persist", persist_stage, on_error=on_stage_error, log=log),
+    feedback,
+)
+
+def show_repeat(action):
+    lcd.show_message(["***  InvenCheck  ***", "", "Already recorded:", action.replace("_", "-").upper()], duration=3)
+
+def reader_loop(nfc):
+    # The debouncer is shared: a tag moved from one reader to the next is still a re-read
     while True:
-        print("\n[NFC] Waiting for NFC tag...")
+        log.debug("nfc", "Waiting for NFC tag", reader=nfc.name)
         try:
             uid = nfc.read_uid()
-            print(f"[NFC] Tag detected: UID {uid}")
-            if check_uovo(uid):
+            now = time.monotonic()
+            recent = debouncer.check(uid, now)
+            if recent is not None:
+                metrics.increment("scans_suppressed")
+                if DEBOUNCE_MODE == "ack" and recent[2] and now - recent[1] > 0.5:
+                    ack = ScanEvent(uid, now, nfc)
+                    ack.feedback = lambda action=recent[2]: show_repeat(action)
+                    ack.final = False
+                    feedback.put(ack)
                 continue
-            lcd.show_message(["***  InvenCheck  ***", "", "Tag detected!", "Reading database..."], duration=60)
-            buzzer.read()
-
-            employee = get_employee_by_uid(uid)
+            log.info("nfc", "Tag detected", uid=uid, reader=nfc.name)
+            metrics.increment("scans")
+            if nfc.last_detection is not None:
+                metrics.observe("nfc", nfc.last_detection)
+            ack = ScanEvent(uid, now, nfc)
+            ack.feedback = show_reading
+            ack.final = False
+            feedback.put(ack)
+            pipeline.submit(ScanEvent(uid, now, nfc))
+            time.sleep(0.25) #wait time for next scan
+        except Exception as e:
+            log.error("nfc", "NFC read failed", reader=nfc.name, error=e)
+            time.sleep(0.5)
 
-            if not employee:
-                employee = register_unknown_employee(uid)
-                if not employee:
-                    continue
+def metrics_report_loop():
+    while True:
+        time.sleep(METRICS_REPORT_INTERVAL)
+        stats = throughput.snapshot()
+        if stats["latency_avg"] is None:
+            continue
+        log.info(
+            "metrics", "Throughput",
+            per_minute=round(stats["per_minute"], 1), peak_per_minute=round(stats["peak_per_minute"], 1),
+            total=stats["total"], avg_ms=round(stats["latency_avg"] * 1000), max_ms=round(stats["latency_max"] * 1000),
+            backlog=pipeline.depth(), suppressed=metrics.counters().get("scans_suppressed", 0),
+        )
+        for line in metrics.latency_summary():
+            log.info("metrics", line)
+
+
+# === Status Endpoint ===
+WORKER_THREADS = (
+    "roster-sync", "nightly-refresh", "heartbeat", "connectivity", "timesync", "outbox", "ledger-sync",
+    "metrics-report", "sysmetrics", "eventlog", "stage-decide", "stage-persist", "stage-feedback", "lcd", "buzzer",
+) + tuple(f"nfc-{reader.name or index}" for index, reader in enumerate(nfc_readers))
+
+def collect_status():
+    now = time.time()
+    alive = {thread.name for thread in threading.enumerate() if thread.is_alive()}
+    threads = {name: name in alive for name in WORKER_THREADS}
+    net = connectivity.snapshot()
+    stats = throughput.snapshot()
+    depth = outbox.depth()
+    return {
+        "device_id": DEVICE_ID,
+        "readers": [
+            {"lane": reader.name, "direction": reader.direction, "irq": reader.irq is not None}
+            for reader in nfc_readers
+        ],
+        "uptime": now - started_at,
+        "connectivity": net,
+        "outbox_depth": depth,
+        "pipeline_depth": pipeline.depth(),
+        "roster_size": len(roster.snapshot),
+        "roster_last_sync": roster.last_sync,
+        "ledger_seeded": ledger.is_current(get_today_cutoff_utc()),
+        "clock_offset": timesvc.offset,
+        "clock_synced": timesvc.synced,
+        "last_heartbeat": last_heartbeat,
+        "scans_per_minute": stats["per_minute"],
+        "system": sampler.summary(),
+        "threads": threads,
+        "gauges": {
+            "uptime_seconds": round(now - started_at, 1),
+            "connectivity_state": {(("state", state),): int(net["state"] == state) for state in (ONLINE, DEGRADED, OFFLINE)},
+            "outbox_depth": depth,
+            "pipeline_depth": pipeline.depth(),
+            "roster_size": len(roster.snapshot),
+            "roster_sync_age_seconds": round(now - roster.last_sync, 1) if roster.last_sync else None,
+            "clock_offset_seconds": round(timesvc.offset, 3),
+            "heartbeat_age_seconds": round(now - last_heartbeat, 1) if last_heartbeat else None,
+            "scans_per_minute": stats["per_minute"],
+            "thread_alive": {(("thread", name),): int(ok) for name, ok in threads.items()},
+        },
+    }
 
-            if employee['user_id'] == "Unknown":
-                print("[INFO] Unknown user!")
-                lcd.show_message(["UNKNOWN TAG","","Please assign this  tag to someone first"])
-                update_unknown_timestamp(uid) #renew timestamp
-                buzzer.error()
-                continue
-            
-            if employee['user_id'].lower() == "morpheus":
-                print("[INFO] Diagnostic Mode activated")
-                lcd.show_message(["***  InvenCheck  ***","","DIAGNOSTIC MODE",""])
-                buzzer.sweep()
-                lcd.show_diagnostic()
-                buzzer.checkin()
-                continue
+status_server = StatusServer(collect_status, STATUS_BIND, STATUS_PORT, log=log) if STATUS_PORT else None
 
-            user_id = employee["user_id"]
-            last_action = get_last_action_today(user_id)
-            action = "check_out" if last_action == "check_in" else "check_in"
 
-            register_action(user_id, action, DEVICE_ID)
-            time.sleep(0.25) #wait time for next scan
+# === Main Loop ===
+def main_loop():
+    log.start()
+    log.info("main", "**** TDK InvenCheck - NFC Attendance System ****")
+    log.info("main", "damiano.milani@tdk.com - 2025")
+    
+    # Avoid blocking startup on remote DB fetch.
+    threading.Thread(target=load_all_employees, name="roster-load", daemon=True).start()
+    threading.Thread(target=nightly_employee_refresh, name="nightly-refresh", daemon=True).start()
+    threading.Thread(target=roster_sync_loop, name="roster-sync", daemon=True).start()
+    threading.Thread(target=device_heartbeat, name="heartbeat", daemon=True).start()
+    connectivity.start()
+    timesvc.start()
+    outbox.start()
+    threading.Thread(target=ledger_sync_loop, name="ledger-sync", daemon=True).start()
+    threading.Thread(target=metrics_report_loop, name="metrics-report", daemon=True).start()
+    sampler.start()
+    pipeline.start()
+    if tracer:
+        tracer.start()
+    if status_server:
+        status_server.start()
+    buzzer.online()
 
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] Network error: {e}")
-            lcd.show_message(["NETWORK ERROR", "Check connection", "Badge again later"])
-            buzzer.error()
-            time.sleep(2)
-        except Exception as e:
-            print(f"[ERROR] {e}")
-            lcd.show_message(["ERROR",str(e)[:60]])
-            buzzer.error()
-            time.sleep(0.5)
+    threads = [
+        threading.Thread(target=reader_loop, args=(reader,), name=f"nfc-{reader.name or index}", daemon=True)
+        for index, reader in enumerate(nfc_readers)
+    ]
+    for thread in threads:
+        thread.start()
+    # systemd stops the service with SIGTERM: turn it into a normal exit so the
+    # local state gets saved below (replay.py runs the daemon on another thread).
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        save_local_state()
 
 if __name__ == "__main__":
     main_loop()
@@ -1,15 +1,167 @@
 """
 Buzzer class definition
-Passive buzzer connected to a Raspberry Pi using hardware PWM (pigpio)
+Passive buzzer connected to a Raspberry Pi, driven by pigpio waveforms
+Songs are played asynchronously by a background playback engine
 
 Damiano Milani
 2025
 """
 
-import pigpio
+import heapq
+import threading
 import time
 import random
 
+WAVE_CHAIN_MAX = 600  # pigpio limit on the length of a wave chain in bytes
+
+
+class _Playback:
+    def __init__(self, segments, priority, interrupt, seq):
+        self.segments = segments
+        self.priority = priority
+        self.interrupt = interrupt
+        self.seq = seq
+        self.done = threading.Event()
+
+    def __lt__(self, other):
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+
+class PlaybackEngine:
+    """
+    Plays songs as pigpio waveforms on a background thread. Each note is one
+    cached single-period wave repeated by a wave-chain loop, so timing comes
+    from the DMA engine instead of time.sleep. A request with a higher priority
+    interrupts the one playing; at the same priority it interrupts only if it
+    was queued with interrupt=True, otherwise it waits in line.
+    """
+
+    def __init__(self, pi, pulse, pin):
+        self.pi = pi
+        self.pulse = pulse
+        self.pin = pin
+        self.waves = {}  # frequency -> wave id
+        self.songs = {}  # (song, tempo, pause) -> chain segments
+        self.cond = threading.Condition()
+        self.pending = []
+        self.current = None
+        self.seq = 0
+        self.running = True
+        threading.Thread(target=self._run, name="buzzer", daemon=True).start()
+
+    def _wave(self, frequency):
+        """Called with self.cond held."""
+        wave_id = self.waves.get(frequency)
+        if wave_id is None:
+            period = int(1_000_000 / frequency)
+            high = period // 2
+            mask = 1 << self.pin
+            self.pi.wave_add_generic([self.pulse(mask, 0, high), self.pulse(0, mask, period - high)])
+            wave_id = self.pi.wave_create()
+            self.waves[frequency] = wave_id
+        return wave_id
+
+    @staticmethod
+    def _delay(microseconds):
+        chain = []
+        if microseconds <= 0:
+            return chain
+        loops, rest = divmod(microseconds, 65535)
+        if loops:
+            chain += [255, 0, 255, 2, 255, 255, 255, 1, loops & 0xFF, loops >> 8]
+        if rest:
+            chain += [255, 2, rest & 0xFF, rest >> 8]
+        return chain
+
+    def compile(self, song, frequencies, tempo=1.0, pause=0.05):
+        # Songs are queued from several threads: pigpio builds every wave in one
+        # shared pulse buffer, so waves and the caches are only touched under the lock
+        with self.cond:
+            return self._compile(song, frequencies, tempo, pause)
+
+    def _compile(self, song, frequencies, tempo, pause):
+        key = (tuple(song), tempo, pause)
+        segments = self.songs.get(key)
+        if segments is not None:
+            return segments
+
+        segments, chain = [], []
+        for (_, duration), frequency in zip(song, frequencies):
+            actual_duration = duration * tempo
+            if frequency > 0:
+                cycles = max(1, min(65535, round(actual_duration * frequency)))
+                part = [255, 0, self._wave(frequency), 255, 1, cycles & 0xFF, cycles >> 8]
+            else:
+                part = self._delay(int(actual_duration * 1_000_000))
+            part += self._delay(int(pause * tempo * 1_000_000))
+            if chain and len(chain) + len(part) > WAVE_CHAIN_MAX:
+                segments.append(chain)
+                chain = []
+            chain += part
+        if chain:
+            segments.append(chain)
+        self.songs[key] = segments
+        return segments
+
+    def play(self, segments, priority, interrupt=True):
+        with self.cond:
+            self.seq += 1
+            request = _Playback(segments, priority, interrupt, self.seq)
+            heapq.heappush(self.pending, request)
+            self.cond.notify()
+        return request
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.current is not None or self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def _preempted(self):
+        if not self.pending:
+            return False
+        head = self.pending[0]
+        return head.priority > self.current.priority or (head.priority == self.current.priority and head.interrupt)
+
+    def _run(self):
+        while self.running:
+            with self.cond:
+                while not self.pending and self.running:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                self.current = heapq.heappop(self.pending)
+
+            request = self.current
+            for segment in request.segments:
+                self.pi.wave_chain(segment)
+                while self.pi.wave_tx_busy():
+                    with self.cond:
+                        if self._preempted():
+                            break
+                        self.cond.wait(0.01)
+                with self.cond:
+                    if self._preempted():
+                        self.pi.wave_tx_stop()
+                        break
+
+            with self.cond:
+                self.current = None
+                request.done.set()
+                self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.pending = []
+            self.cond.notify_all()
+        self.pi.wave_tx_stop()
+
+
 class Buzzer:
     NOTES = {
         'B0': 31, 'C1': 33, 'CS1': 35, 'D1': 37, 'DS1': 39, 'E1': 41, 'F1': 44, 'FS1': 46, 'G1': 49, 'GS1': 52,
@@ -26,35 +178,46 @@ class Buzzer:
         'REST': 0
     }
 
-    def __init__(self, pin, default_freq=2000):
+    PRIORITY_MUSIC = 0
+    PRIORITY_FEEDBACK = 1
+    PRIORITY_ALERT = 2
+
+    def __init__(self, pin, default_freq=2000, backend=None):
+        if backend is None:
+            import pigpio as backend
         self.pin = pin
         self.default_freq = default_freq
-        self.pi = pigpio.pi()
+        self.pi = backend.pi()
         if not self.pi.connected:
             raise RuntimeError("Cannot connect to pigpio daemon. Make sure 'pigpiod' is running.")
-        self.pi.set_mode(self.pin, pigpio.OUTPUT)
+        self.pi.set_mode(self.pin, backend.OUTPUT)
+        self.pi.write(self.pin, 0)
+        self.engine = PlaybackEngine(self.pi, backend.pulse, self.pin)
         print("[INIT] Buzzer ready")
 
-    def beep(self, frequency=None, duration=0.1):
-        if frequency and frequency > 0:
-            self.pi.hardware_PWM(self.pin, frequency, 500000)  # 50% duty cycle
-            time.sleep(duration)
-            self.pi.hardware_PWM(self.pin, 0, 0)  # Stop
-        else:
-            time.sleep(duration)
+    def beep(self, frequency=None, duration=0.1, priority=PRIORITY_FEEDBACK):
+        return self.play_song([(frequency or 0, duration)], pause=0, priority=priority)
 
-    def note(self, name, duration=0.1):
-        freq = self.NOTES.get(name.upper(), 0)
-        self.beep(freq, duration)
+    def note(self, name, duration=0.1, priority=PRIORITY_FEEDBACK):
+        return self.play_song([(name, duration)], pause=0, priority=priority)
 
-    def play_song(self, song, tempo=1.0, pause=0.05):
-        for note, duration in song:
-            actual_duration = duration * tempo
-            if note.upper() == 'REST':
-                time.sleep(actual_duration)
-            else:
-                self.note(note, actual_duration)
-            time.sleep(pause * tempo)
+    def _frequency(self, note):
+        if isinstance(note, (int, float)):
+            return int(note)
+        return self.NOTES.get(note.upper(), 0)
+
+    def play_song(self, song, tempo=1.0, pause=0.05, priority=PRIORITY_FEEDBACK, wait=False):
+        """Queue a song and return immediately (unless wait=True)."""
+        segments = self.engine.compile(song, [self._frequency(note) for note, _ in song], tempo, pause)
+        # Feedback and alerts replace a tone of the same kind; music queues up
+        request = self.engine.play(segments, priority, interrupt=priority > self.PRIORITY_MUSIC)
+        if wait:
+            request.done.wait()
+        return request
+
+    def wait(self, timeout=None):
+        """Block until everything queued so far has been played."""
+        return self.engine.wait_idle(timeout)
 
     # Preset tones
     def read(self):
@@ -70,17 +233,15 @@ class Buzzer:
         self.play_song([('C7',0.1),('A6',0.1),('F6',0.2)])
 
     def error(self):
-        self.play_song([('C3',0.2),('C3',0.2),('C3',0.2)])
+        self.play_song([('C3',0.2),('C3',0.2),('C3',0.2)], priority=self.PRIORITY_ALERT)
 
     def sweep(self):
-        for note in reversed(self.NOTES):
-            self.note(note, 0.005)
-            time.sleep(0.001)
+        self.play_song([(note, 0.005) for note in reversed(self.NOTES)], pause=0.001)
 
     def xmas(self):
         xmas_songs = [self.jingle_bells,self.we_wish_you,self.tu_scendi]
         song_to_play = random.choice(xmas_songs)
-        self.play_song([('REST', 0.5)])
+        self.play_song([('REST', 0.5)], priority=self.PRIORITY_MUSIC)
         song_to_play()
 
     # Songs
@@ -89,13 +250,13 @@ class Buzzer:
         ('REST', 0.4), ('D4', 0.4), ('G4', 0.4), ('D4', 0.4), ('AS4', 0.4), ('D4', 0.4), ('G4', 0.4), ('D4', 0.4),  
         ('C5', 0.4), ('D4', 0.4), ('FS4', 0.4), ('D4', 0.4), ('A4', 0.4), ('D4', 0.4), ('FS4', 0.4), ('D4', 0.4),  
         ]
-        self.play_song(song, tempo=0.7, pause=0.05)
+        self.play_song(song, tempo=0.7, pause=0.05, priority=self.PRIORITY_MUSIC)
     def matrix2(self):
         song = [
         ('REST', 0.4), ('D4', 0.4), ('G4', 0.4), ('D4', 0.4), ('D5', 0.4), ('D4', 0.4), ('AS4', 0.4), ('D4', 0.4),  
         ('AS4', 0.4), ('C4', 0.4), ('DS4', 0.4), ('C4', 0.4), ('A4', 0.4), ('DS4', 0.4), ('C5', 0.4), ('DS4', 0.4),  
         ]
-        self.play_song(song, tempo=0.7, pause=0.05)
+        self.play_song(song, tempo=0.7, pause=0.05, priority=self.PRIORITY_MUSIC)
     def matrix3(self):
         song = [
         ('REST', 0.4), ('D4', 0.4), ('G4', 0.4), ('D4', 0.4), ('AS4', 0.4), ('G4', 0.4), ('D5', 0.4), ('AS4', 0.4),  
@@ -108,7 +269,7 @@ class Buzzer:
         ('D5', 0.4), ('AS4', 0.4), ('G5', 0.4), ('D5', 0.4), ('AS5', 0.4), ('G5', 0.4), ('D6', 0.4), ('AS5', 0.4), 
         ('G6', 0.4)
         ]
-        self.play_song(song, tempo=0.7, pause=0.05)
+        self.play_song(song, tempo=0.7, pause=0.05, priority=self.PRIORITY_MUSIC)
 
     def mario(self):
         song = [
@@ -120,7 +281,7 @@ class Buzzer:
             ('F5', 0.1), ('G5', 0.1), ('REST', 0.1), ('E5', 0.1),
             ('C5', 0.1), ('D5', 0.1), ('B4', 0.1), ('REST', 0.3),
         ]
-        self.play_song(song)
+        self.play_song(song, priority=self.PRIORITY_MUSIC)
 
     def star_wars(self):
         song = [
@@ -142,7 +303,7 @@ class Buzzer:
             ('F6', 0.25), ('DS6', 0.125), ('CS6', 0.25), ('C6', 0.125), ('AS5', 0.25), ('GS5', 0.125), ('G5', 0.25), ('F5', 0.125),
             ('C6', 1.0)
         ]
-        self.play_song(song)
+        self.play_song(song, priority=self.PRIORITY_MUSIC)
 
     def imperial(self):
         sw = [
@@ -153,7 +314,7 @@ class Buzzer:
             ('F4', 0.35), ('C4', 0.15), ('GS3', 0.5),
             ('F3', 0.35), ('C4', 0.15), ('A3', 0.8),
         ]
-        self.play_song(sw)
+        self.play_song(sw, priority=self.PRIORITY_MUSIC)
 
     def game_of_thrones(self):
         song = [
@@ -165,7 +326,7 @@ class Buzzer:
             ('G4', 0.25), ('C4', 0.25), ('DS4', 0.0625), ('F4', 0.0625), ('G4', 0.25), ('C4', 0.25), ('DS4', 0.0625), ('F4', 0.0625),
             ('D4', 0.5), ('F4', 0.25), ('AS3', 0.25), ('D4', 0.125), ('DS4', 0.125), ('D4', 0.125), ('AS3', 0.125), ('C4', 1.0)
         ]
-        self.play_song(song,tempo=1.2)
+        self.play_song(song,tempo=1.2, priority=self.PRIORITY_MUSIC)
 
     def take_on_me(self):
         song = [('FS5', 0.125), ('FS5', 0.125), ('D5', 0.125), ('B4', 0.25), ('B4', 0.25), ('E5', 0.25),
@@ -173,14 +334,14 @@ class Buzzer:
                 ('A5', 0.125), ('A5', 0.125), ('A5', 0.125), ('E5', 0.25), ('D5', 0.25), ('FS5', 0.25),
                 ('FS5', 0.25), ('FS5', 0.125), ('E5', 0.125), ('E5', 0.125), ('FS5', 0.125), ('E5', 0.125)
                 ]
-        self.play_song(song)
+        self.play_song(song, priority=self.PRIORITY_MUSIC)
 
     def star_trek(self):
         song = [
             ('D4', 0.083333), ('G4', 0.0625), ('C5', 0.375),
             ('B4', 0.125), ('G4', 0.041666), ('E4', 0.041666), ('A4', 0.041666), ('D5', 0.5)
         ]
-        self.play_song(song,tempo=1.5)    
+        self.play_song(song,tempo=1.5, priority=self.PRIORITY_MUSIC)
 
     def harry_potter(self):
         song = [('D4', 0.25),
@@ -217,7 +378,7 @@ class Buzzer:
                 ('DS5', 0.375), ('D5', 0.125), ('CS5', 0.25),
                 ('CS4', 0.5), ('AS4', 0.25),
                 ('G4', 0.6666)]
-        self.play_song(song) 
+        self.play_song(song, priority=self.PRIORITY_MUSIC) 
         
     def ode_to_joy(self):
         song = [('A4', 0.25), ('A4', 0.25), ('AS4', 0.25), ('C5', 0.25),
@@ -225,7 +386,7 @@ class Buzzer:
                 ('F4', 0.25), ('F4', 0.25), ('G4', 0.25), ('A4', 0.25),
                 ('A4', 0.375), ('G4', 0.125), ('G4', 0.5)]
         
-        self.play_song(song) 
+        self.play_song(song, priority=self.PRIORITY_MUSIC) 
 
     def jingle_bells(self):
         song = [
@@ -233,7 +394,7 @@ class Buzzer:
             ('E5', 0.25), ('E5', 0.25), ('E5', 0.5),
             ('E5', 0.25), ('G5', 0.25), ('C5', 0.25), ('D5', 0.25), ('E5', 1.0),
         ]
-        self.play_song(song,tempo=0.75)
+        self.play_song(song,tempo=0.75, priority=self.PRIORITY_MUSIC)
 
     def we_wish_you(self):
         song = [
@@ -242,7 +403,7 @@ class Buzzer:
             ('E5', 1), ('A5', 1), ('A5', 0.5), ('B5', 0.5), ('A5', 0.5), ('G5', 0.5),
             ('FS5', 1), ('D5', 1),
         ]
-        self.play_song(song,tempo=0.3)
+        self.play_song(song,tempo=0.3, priority=self.PRIORITY_MUSIC)
 
     def tu_scendi(self):
         song = [
@@ -253,15 +414,18 @@ class Buzzer:
             ('G5', 0.25),('F5', 0.25),('E5', 0.25),
             ('D5', 1),
         ]
-        self.play_song(song,tempo=0.75)
+        self.play_song(song,tempo=0.75, priority=self.PRIORITY_MUSIC)
 
     def close(self):
-        self.pi.hardware_PWM(self.pin, 0, 0)
+        self.engine.stop()
+        self.pi.write(self.pin, 0)
+        self.pi.wave_clear()
         self.pi.stop()
 
 
 if __name__ == "__main__":
     buzzer = Buzzer(pin=13)  # GPIO18 supports hardware PWM0
     buzzer.xmas()
+    buzzer.wait()
     buzzer.close()
 
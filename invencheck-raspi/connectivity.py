@@ -0,0 +1,136 @@
+"""
+ConnectivityMonitor class definition
+Connection state derived from the outcome of real Supabase requests, with a
+circuit breaker that fails fast while the server is unreachable
+
+Damiano Milani
+2025
+"""
+
+import threading
+import time
+from collections import deque
+
+import requests
+
+from eventlog import EventLog
+
+ONLINE = "ONLINE"
+DEGRADED = "DEGRADED"
+OFFLINE = "OFFLINE"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the breaker is open."""
+
+
+class ConnectivityMonitor:
+    def __init__(self, probe=None, failure_threshold=3, cooldown=5, max_cooldown=60,
+                 idle_interval=60, slow_latency=1.5, window=20, on_change=None, log=None):
+        """
+        probe() sends a cheap request through the client (bypassing the breaker);
+        its outcome reaches the monitor through the client hooks like any other.
+        """
+        self.probe = probe
+        self.log = log or EventLog()
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.idle_interval = idle_interval
+        self.slow_latency = slow_latency
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window)  # (ok, latency)
+        self.consecutive_failures = 0
+        self.cooldown = cooldown
+        self.open_until = None  # monotonic time; None while the breaker is closed
+        self.last_outcome = 0.0
+        self.state = ONLINE
+
+    def start(self):
+        threading.Thread(target=self._loop, name="connectivity", daemon=True).start()
+
+    # --- Client hooks ---
+    def check(self):
+        """Gate called by the client before every request."""
+        with self.lock:
+            is_open = self.open_until is not None
+        if is_open:
+            raise CircuitOpenError("Supabase unreachable, circuit breaker open")
+
+    def on_response(self, start, end, response):
+        ok = response.status_code < 500 and response.status_code != 429
+        self._record(ok, end - start)
+
+    def on_error(self, start, end, error):
+        self._record(False, end - start)
+
+    def _record(self, ok, latency):
+        now = time.monotonic()
+        with self.lock:
+            self.outcomes.append((ok, latency))
+            self.last_outcome = now
+            if ok:
+                self.consecutive_failures = 0
+                self.open_until = None
+                self.cooldown = self.base_cooldown
+            else:
+                self.consecutive_failures += 1
+                if self.open_until is not None:
+                    # A failed probe keeps the breaker open for longer
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self.open_until = now + self.cooldown
+                elif self.consecutive_failures >= self.failure_threshold:
+                    self.open_until = now + self.cooldown
+        self._update_state()
+
+    # --- State ---
+    def _evaluate(self):
+        with self.lock:
+            if self.open_until is not None:
+                return OFFLINE
+            if not self.outcomes:
+                return ONLINE
+            errors = sum(1 for ok, _ in self.outcomes if not ok)
+            latencies = sorted(latency for ok, latency in self.outcomes if ok)
+        median = latencies[len(latencies) // 2] if latencies else 0.0
+        if errors / len(self.outcomes) > 0.2 or median > self.slow_latency:
+            return DEGRADED
+        return ONLINE
+
+    def _update_state(self):
+        state = self._evaluate()
+        with self.lock:
+            previous, self.state = self.state, state
+        if state != previous and self.on_change:
+            try:
+                self.on_change(previous, state)
+            except Exception as e:
+                self.log.warn("net", "Connectivity callback error", error=e)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in": max(0.0, self.open_until - time.monotonic()) if self.open_until else None,
+            }
+
+    # --- Active probing, only when real traffic gives no signal ---
+    def _loop(self):
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            with self.lock:
+                open_until = self.open_until
+                idle = now - self.last_outcome >= self.idle_interval
+            if open_until is not None and now < open_until:
+                continue
+            if open_until is None and not idle:
+                continue
+            if self.probe is None:
+                continue
+            try:
+                self.probe()
+            except Exception:
+                pass  # Already recorded through the client hooks
@@ -0,0 +1,176 @@
+"""
+EventLog class definition
+Structured logger with levels and key/value fields. Callers only append to an
+in-memory ring buffer; a background thread writes batches to journald (stdout)
+or to a size-rotated file, so logging never waits on the SD card.
+
+Damiano Milani
+2025
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+# syslog priorities understood by journald as a "<N>" line prefix on stdout
+SYSLOG_PRIORITY = {DEBUG: 7, INFO: 6, WARN: 4, ERROR: 3}
+
+
+def parse_level(value, default=INFO):
+    if value is None:
+        return default
+    return LEVELS.get(str(value).upper(), default)
+
+
+class EventLog:
+    def __init__(self, level=INFO, channel_levels=None, capacity=4096, recent=64, flush_interval=1.0,
+                 path=None, max_bytes=1_000_000, backups=3, stream=None):
+        """
+        With path=None entries go to stdout; under systemd they carry syslog
+        priority prefixes, which journald turns into log levels. Otherwise they
+        are appended to path, rotated to path.1 ... path.<backups> when it grows
+        past max_bytes.
+        """
+        self.level = level
+        self.channel_levels = dict(channel_levels or {})
+        self.flush_interval = flush_interval
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stream = stream or sys.stdout
+        self.syslog_prefix = "JOURNAL_STREAM" in os.environ  # stdout is connected to journald
+        self.lock = threading.Lock()
+        self.pending = deque(maxlen=capacity)  # (time, level, channel, message, fields)
+        self.recent = deque(maxlen=recent)
+        self.dropped = 0
+        self.wakeup = threading.Event()
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._flusher_loop, name="eventlog", daemon=True).start()
+
+    # --- Producers (any thread, never blocks on I/O) ---
+    def log(self, level, channel, message, **fields):
+        if level < self.channel_levels.get(channel, self.level):
+            return
+        entry = (time.time(), level, channel, message, fields)
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(entry)
+            self.recent.append(entry)
+        if level >= ERROR or not self.started:
+            self.wakeup.set()
+            if not self.started:
+                self.flush()
+
+    def debug(self, channel, message, **fields):
+        self.log(DEBUG, channel, message, **fields)
+
+    def info(self, channel, message, **fields):
+        self.log(INFO, channel, message, **fields)
+
+    def warn(self, channel, message, **fields):
+        self.log(WARN, channel, message, **fields)
+
+    def error(self, channel, message, **fields):
+        self.log(ERROR, channel, message, **fields)
+
+    # --- Formatting, done on the flusher thread ---
+    @staticmethod
+    def _format_fields(fields):
+        parts = []
+        for key, value in fields.items():
+            text = str(value)
+            if not text or any(c in text for c in ' ="'):
+                text = '"' + text.replace('"', '\\"') + '"'
+            parts.append(f"{key}={text}")
+        return " ".join(parts)
+
+    def format(self, entry, timestamps=True):
+        created, level, channel, message, fields = entry
+        line = f"[{LEVEL_NAMES[level]}] {channel}: {message}"
+        if fields:
+            line += " " + self._format_fields(fields)
+        if timestamps:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))
+            line = f"{stamp}.{int(created % 1 * 1000):03d} {line}"
+        return line
+
+    # --- Consumer ---
+    def _take(self):
+        with self.lock:
+            entries = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        return entries, dropped
+
+    def flush(self):
+        entries, dropped = self._take()
+        if not entries and not dropped:
+            return
+        if self.path is None and self.syslog_prefix:
+            lines = [f"<{SYSLOG_PRIORITY[entry[1]]}>{self.format(entry, timestamps=False)}" for entry in entries]
+        elif self.path is None:
+            lines = [self.format(entry, timestamps=False) for entry in entries]
+        else:
+            lines = [self.format(entry) for entry in entries]
+        if dropped:
+            lines.append(f"[WARN] log: {dropped} entries dropped, ring buffer full")
+        data = "\n".join(lines) + "\n"
+        try:
+            if self.path is None:
+                self.stream.write(data)
+                self.stream.flush()
+            else:
+                self._rotate(len(data))
+                with open(self.path, "a") as f:
+                    f.write(data)
+        except Exception as e:
+            sys.stderr.write(f"[ERROR] log: flush failed: {e}\n")
+
+    def _rotate(self, incoming):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size + incoming <= self.max_bytes:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{index}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _flusher_loop(self):
+        while True:
+            # Batch everything logged during the interval into one write
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    # --- Diagnostic screen ---
+    def screens(self, min_level=WARN, count=4):
+        """Latest entries at min_level or above, two per 20x4 screen."""
+        with self.lock:
+            entries = [entry for entry in self.recent if entry[1] >= min_level][-count:]
+        if not entries:
+            return [["LOG", "", "No warnings", ""]]
+        screens = []
+        for i in range(0, len(entries), 2):
+            screen = []
+            for created, level, channel, message, fields in entries[i:i + 2]:
+                screen.append(f"{time.strftime('%H:%M:%S', time.localtime(created))} {LEVEL_NAMES[level][:4]} {channel}"[:20])
+                screen.append(message[:20])
+            screens.append(screen)
+        return screens
@@ -0,0 +1,60 @@
+"""
+Hardware abstraction layer
+Builds the buzzer, LCD and NFC reader either on the real devices or on their
+simulated counterparts (pigpio_mock, lcd_mock, pn532_mock), so that the daemon
+can run, be profiled and load-tested on any Linux box.
+
+Damiano Milani
+2025
+"""
+
+REAL = "real"
+SIMULATED = "sim"
+
+SIM_UIDS = ("04A1B2C3", "04D5E6F7", "0411223344", "04AABBCCDD")
+
+
+def _check(mode):
+    if mode not in (REAL, SIMULATED):
+        raise ValueError(f"Unknown hardware mode '{mode}' (expected '{REAL}' or '{SIMULATED}')")
+
+
+def create_buzzer(mode, pin):
+    _check(mode)
+    from buzzer import Buzzer
+    if mode == SIMULATED:
+        import pigpio_mock
+        return Buzzer(pin, backend=pigpio_mock)
+    return Buzzer(pin)
+
+
+def create_lcd(mode, sampler=None):
+    _check(mode)
+    from lcd import LCD
+    if mode == SIMULATED:
+        from lcd_mock import MockCharLCD
+        return LCD(driver=MockCharLCD(), sampler=sampler)
+    return LCD(sampler=sampler)
+
+
+def simulated_arrivals(script=None, rate_per_minute=6, uids=SIM_UIDS, seed=None):
+    """Scripted arrivals from a file, or an endless random (Poisson) arrival process."""
+    from pn532_mock import SimulatedPN532
+    if script:
+        return SimulatedPN532.load_script(script)
+    return SimulatedPN532.poisson_arrivals(rate_per_minute, list(uids), seed=seed)
+
+
+def create_nfc(mode, arrivals=None, **options):
+    """options are passed to NFCReader (name, cs_pin, irq_pin, bus, direction, spi_baudrate, schedule...)."""
+    _check(mode)
+    from nfc import NFCReader
+    if mode == SIMULATED:
+        from pn532_mock import SimulatedPN532
+        chip = SimulatedPN532()
+        options.pop("irq_pin", None)
+        reader = NFCReader(backend=chip, irq=chip.irq, **options)
+        if arrivals is not None:
+            chip.play(arrivals)
+        return reader
+    return NFCReader(**options)
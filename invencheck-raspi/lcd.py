@@ -6,39 +6,98 @@ Damiano Milani
 2025
 """
 
-from RPLCD.i2c import CharLCD
-import socket
 import time
 import threading
-import subprocess
-import psutil
 from datetime import datetime
 
 class LCD:
-    def __init__(self, address=0x27, cols=20, rows=4, default_interval=5, backlight_timeout=300):
-        self.lcd = CharLCD('PCF8574', address, cols=cols, rows=rows, backlight_enabled=True, auto_linebreaks=True)
+    def __init__(self, address=0x27, cols=20, rows=4, default_interval=5, backlight_timeout=300, driver=None, differential=True, sampler=None):
+        if driver is None:
+            from RPLCD.i2c import CharLCD
+            driver = CharLCD('PCF8574', address, cols=cols, rows=rows, backlight_enabled=True, auto_linebreaks=True)
+        self.lcd = driver
+        self.cols = cols
+        self.rows = rows
+        self.differential = differential
+        self.sampler = sampler
+        self.diagnostic_running = False
         self.default_interval = default_interval
         self.backlight_timeout = backlight_timeout
         self.last_interaction_time = time.time()
         self.active_message_until = 0
         self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.backlight_on = True
         self.last_minute_displayed = None
         self.current_lines = ["", "", "", ""]
 
-        threading.Thread(target=self._screen_manager_loop, daemon=True).start()
+        # Shadow copy of what is on the glass, used to send only the changed cells
+        self.lcd.clear()
+        self.framebuffer = [" " * cols for _ in range(rows)]
+        self.cursor = (0, 0)
+
+        threading.Thread(target=self._screen_manager_loop, name="lcd", daemon=True).start()
         print("[INIT] LCD ready")
 
     def clear(self):
         with self.lock:
             self.lcd.clear()
+            self.framebuffer = [" " * self.cols for _ in range(self.rows)]
+            self.cursor = (0, 0)
+
+    @staticmethod
+    def _changed_runs(old, new):
+        """Yield (start, end) column ranges where new differs from old.
+        Runs separated by a single unchanged cell are merged: rewriting one cell
+        costs the same as the cursor move needed to skip it."""
+        runs = []
+        for col, (a, b) in enumerate(zip(old, new)):
+            if a == b:
+                continue
+            if runs and col - runs[-1][1] <= 1:
+                runs[-1][1] = col + 1
+            else:
+                runs.append([col, col + 1])
+        return runs
+
+    def _render(self, lines):
+        """Lay lines out the way the controller does: each starts on its own row and
+        longer text wraps onto the following rows (auto_linebreaks)."""
+        grid = [[" "] * self.cols for _ in range(self.rows)]
+        for i, line in enumerate(lines[:self.rows]):
+            if not len(line):
+                continue
+            text = line.ljust(self.cols)
+            row, col = i, 0
+            for char in text:
+                grid[row][col] = char
+                col += 1
+                if col == self.cols:
+                    row, col = (row + 1) % self.rows, 0
+        return ["".join(row) for row in grid]
 
     def _write_lines(self, lines):
         with self.lock:
-            self.clear()
-            for i, line in enumerate(lines[:4]):
-                if len(line):
-                    self.lcd.cursor_pos = (i, 0)
-                    self.lcd.write_string(line.ljust(20))
+            if not self.differential:
+                self.clear()
+                for i, line in enumerate(lines[:self.rows]):
+                    if len(line):
+                        self.lcd.cursor_pos = (i, 0)
+                        self.lcd.write_string(line.ljust(self.cols))
+                self.framebuffer = self._render(lines)
+                self.cursor = None
+                self.current_lines = lines
+                return
+
+            for row, new in enumerate(self._render(lines)):
+                old = self.framebuffer[row]
+                for start, end in self._changed_runs(old, new):
+                    if self.cursor != (row, start):
+                        self.lcd.cursor_pos = (row, start)
+                    self.lcd.write_string(new[start:end])
+                    # Writing up to the last column makes the controller wrap: position unknown
+                    self.cursor = (row, end) if end < self.cols else None
+                self.framebuffer[row] = new
             self.current_lines = lines
 
     def show_message(self, lines, duration=None):
@@ -47,112 +106,48 @@ class LCD:
         with self.lock:
             self.last_interaction_time = time.time()
             self.active_message_until = self.last_interaction_time + duration
-            self.lcd.backlight_enabled = True
-        self._write_lines(lines)
-
-    def show_diagnostic(self):
-        def get_diagnostic_screens():
-            hostname = socket.gethostname()
-
-            def get_interface_ssid(interface):
-                try:
-                    return subprocess.check_output(['iwgetid', interface, '-r'], text=True).strip() or "Unknown"
-                except:
-                    return "Unknown"
-
-            def get_interface_ip(interface):
-                try:
-                    ip_output = subprocess.check_output(['ip', '-4', 'addr', 'show', interface], text=True)
-                    ip_line = next((line for line in ip_output.splitlines() if "inet " in line), "")
-                    return ip_line.split()[1].split('/')[0] if ip_line else "N/A"
-                except:
-                    return "N/A"
-
-            def get_interface_signal(interface):
-                try:
-                    with open('/proc/net/wireless', 'r') as f:
-                        lines = f.readlines()
-                    target_line = next((line for line in lines if line.strip().startswith(f"{interface}:")), None)
-                    if not target_line:
-                        return "N/A", "N/A", "Unknown"
-
-                    fields = target_line.replace(':', ' ').split()
-                    link_quality = float(fields[2].rstrip('.'))
-                    level_dbm = int(float(fields[3].rstrip('.')))
-                    quality_pct = max(0, min(100, int((link_quality / 70.0) * 100)))
-
-                    if quality_pct >= 75:
-                        stability = "Stable"
-                    elif quality_pct >= 45:
-                        stability = "Fair"
-                    elif quality_pct > 0:
-                        stability = "Weak"
-                    else:
-                        stability = "NoLink"
-
-                    return f"{quality_pct}%", f"{level_dbm}dBm", stability
-                except:
-                    return "N/A", "N/A", "Unknown"
-
-            def build_wlan_screen(interface):
-                ssid = get_interface_ssid(interface)
-                ip_addr = get_interface_ip(interface)
-                quality, level_dbm, stability = get_interface_signal(interface)
-                return [
-                    f"{interface.upper()} {hostname[:13]}",
-                    f"SSID {ssid[:15]}",
-                    f"IP   {ip_addr[:15]}",
-                    f"SIG  {level_dbm} {quality} {stability[:5]}",
-                ]
-
-            # Git info from parent directory
-            try:
-                import os
-                repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-                git_hash = subprocess.check_output(['git', '-C', repo_dir, 'rev-parse', 'HEAD'], text=True).strip()[:7]
-                git_raw_date = subprocess.check_output(['git', '-C', repo_dir, 'log', '-1', '--format=%cd'], text=True).strip()
-                git_date = datetime.strptime(git_raw_date, '%a %b %d %H:%M:%S %Y %z').strftime('%d%b%y')
-            except:
-                git_hash = "no-git"
-                git_date = "unknown"
-
-            # CPU Temp
-            try:
-                with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-                    temp_c = int(f.read().strip()) / 1000.0
-            except:
-                temp_c = 0.0
-
-            # CPU and memory usage
-            cpu_usage = psutil.cpu_percent(interval=0.1)
-            mem_usage = psutil.virtual_memory().percent
-
-            # Uptime
-            uptime_seconds = time.time() - psutil.boot_time()
-            days = int(uptime_seconds // 86400)
-            hours = int((uptime_seconds % 86400) // 3600)
-            minutes = int((uptime_seconds % 3600) // 60)
-            uptime_str = f"{days}d{hours}h{minutes}m"
-
-            screen_base = [
-                f"GIT  {git_hash} {git_date}",
-                f"CPU  {cpu_usage:.0f}%    MEM  {mem_usage:.0f}%",
-                f"TEMP {temp_c:.1f}C",
-                f"UP   {uptime_str}",
-            ]
-            screen_wlan0 = build_wlan_screen('wlan0')
-            screen_wlan1 = build_wlan_screen('wlan1')
-
-            return [screen_base, screen_wlan0, screen_wlan1]
-
+            self._set_backlight(True)
+            self._write_lines(lines)
+            self.wakeup.notify()
+
+    def _set_backlight(self, enabled):
+        # Every assignment is an I2C write, so only touch the backpack on a change
+        if enabled != self.backlight_on:
+            self.lcd.backlight_enabled = enabled
+            self.backlight_on = enabled
+
+    def show_diagnostic(self, extra_screens=None, on_done=None):
+        """Cycle the diagnostic screens on a background thread and return immediately."""
+        with self.lock:
+            if self.diagnostic_running:
+                return
+            self.diagnostic_running = True
+        if self.sampler is None:
+            from sysmetrics import SystemSampler
+            self.sampler = SystemSampler()
+        threading.Thread(target=self._diagnostic_cycle, args=(extra_screens, on_done), daemon=True).start()
+
+    def _diagnostic_cycle(self, extra_screens, on_done):
         try:
-            screens = get_diagnostic_screens()
-            for screen in screens:
-                self.show_message(screen, duration=5)
+            shown = None
+            for screen in self.sampler.screens() + list(extra_screens or []):
+                with self.lock:
+                    # Stop cycling as soon as a scan puts its own message on screen
+                    if shown is not None and self.current_lines != shown:
+                        return
+                    self.show_message(screen, duration=5)
+                    shown = screen
                 time.sleep(5)
-            self._default_screen(force=True)
+            with self.lock:
+                if self.current_lines == shown:
+                    self._default_screen(force=True)
+            if on_done:
+                on_done()
         except Exception as e:
             self.show_message(["Diagnostic Fail", str(e), "", ""], duration=self.default_interval)
+        finally:
+            with self.lock:
+                self.diagnostic_running = False
 
     
     def _default_screen(self, force=False):
@@ -172,20 +167,26 @@ class LCD:
         self._write_lines(self.default_screen_lines)
 
     def _screen_manager_loop(self):
-        self._default_screen(force=True)
-        while True:
-            time.sleep(0.5)
-            now = time.time()
+        """Sleep until the next deadline (message expiry, backlight timeout or
+        minute change) instead of polling; show_message wakes the loop early."""
+        with self.lock:
+            self._default_screen(force=True)
+            while True:
+                now = time.time()
 
-            with self.lock:
                 # Backlight timeout
-                if now - self.last_interaction_time >= self.backlight_timeout:
-                    self.lcd.backlight_enabled = False
-                else:
-                    self.lcd.backlight_enabled = True
+                backlight_off_at = self.last_interaction_time + self.backlight_timeout
+                self._set_backlight(now < backlight_off_at)
 
-                # Return to default screen
+                # Return to default screen, or refresh its clock
                 if self.current_lines != self.default_screen_lines and now >= self.active_message_until:
                     self._default_screen(force=True)
                 elif self.current_lines == self.default_screen_lines:
                     self._default_screen(force=False)
+
+                deadlines = [now - now % 60 + 60]  # next minute boundary
+                if self.active_message_until > now:
+                    deadlines.append(self.active_message_until)
+                if self.backlight_on:
+                    deadlines.append(backlight_off_at)
+                self.wakeup.wait(max(0.0, min(deadlines) - time.time()) + 0.01)
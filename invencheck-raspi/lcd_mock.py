@@ -0,0 +1,121 @@
+"""
+Mock LCD backend
+Stand-in for RPLCD's CharLCD on a PCF8574 backpack that keeps the display
+contents in memory and counts the I2C transactions the real one would send.
+
+Damiano Milani
+2025
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class CountingI2CBus:
+    # In 4-bit mode every byte is sent as two nibbles and every nibble costs three
+    # bus writes on the PCF8574 (data, data|EN, data&~EN).
+    WRITES_PER_BYTE = 6
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transactions = 0
+        self.commands = 0
+        self.data_bytes = 0
+        self.controller_delay = 0.0  # seconds the HD44780 needs to execute the commands
+
+    def command(self, delay=0.0):
+        with self.lock:
+            self.commands += 1
+            self.transactions += self.WRITES_PER_BYTE
+            self.controller_delay += delay
+
+    def data(self, count):
+        with self.lock:
+            self.data_bytes += count
+            self.transactions += count * self.WRITES_PER_BYTE
+
+    def single_write(self):
+        with self.lock:
+            self.transactions += 1
+
+    def reset(self):
+        with self.lock:
+            self.transactions = self.commands = self.data_bytes = 0
+            self.controller_delay = 0.0
+
+
+class MockCharLCD:
+    def __init__(self, cols=20, rows=4, bus=None):
+        self.cols = cols
+        self.rows = rows
+        self.bus = bus or CountingI2CBus()
+        self.ram = [[" "] * cols for _ in range(rows)]
+        self._cursor = (0, 0)
+        self._backlight = True
+        self.writes = deque(maxlen=1000)  # (monotonic time, row, col, text) of every write_string
+
+    @property
+    def cursor_pos(self):
+        return self._cursor
+
+    @cursor_pos.setter
+    def cursor_pos(self, value):
+        self.bus.command()
+        self._cursor = value
+
+    @property
+    def backlight_enabled(self):
+        return self._backlight
+
+    @backlight_enabled.setter
+    def backlight_enabled(self, value):
+        self.bus.single_write()
+        self._backlight = value
+
+    def clear(self):
+        self.bus.command(delay=0.002)
+        self.ram = [[" "] * self.cols for _ in range(self.rows)]
+        self._cursor = (0, 0)
+
+    def write_string(self, text):
+        self.bus.data(len(text))
+        row, col = self._cursor
+        self.writes.append((time.monotonic(), row, col, text))
+        for char in text:
+            self.ram[row][col] = char
+            col += 1
+            if col == self.cols:  # auto_linebreaks
+                row, col = (row + 1) % self.rows, 0
+        self._cursor = (row, col)
+
+    def lines(self):
+        return ["".join(row) for row in self.ram]
+
+
+if __name__ == "__main__":
+    # Compare full redraws with differential updates on a typical sequence of screens
+    import time
+    from lcd import LCD
+
+    screens = [
+        ["***  InvenCheck  ***", "", "Place NFC tag below", "2025-03-10     08:29"],
+        ["***  InvenCheck  ***", "", "Place NFC tag below", "2025-03-10     08:30"],
+        ["***  InvenCheck  ***", "", "Tag detected!", "Reading database..."],
+        ["Rossi Mario", "", "~~~~  CHECK-IN  ~~~~", "2025-03-10     08:30"],
+        ["Bianchi Anna", "", "⌂⌂⌂⌂  CHECK-OUT  ⌂⌂⌂", "2025-03-10     08:30"],
+        ["UNKNOWN TAG", "", "Please assign this  tag to someone first"],
+        ["***  InvenCheck  ***", "", "Place NFC tag below", "2025-03-10     08:31"],
+    ]
+    for differential in (False, True):
+        driver = MockCharLCD()
+        lcd = LCD(driver=driver, differential=differential)
+        time.sleep(0.1)
+        driver.bus.reset()
+        for screen in screens:
+            lcd.show_message(screen, duration=60)
+        expected = lcd._render(screens[-1])
+        assert driver.lines() == expected, (driver.lines(), expected)
+        label = "differential" if differential else "full redraw"
+        print(f"{label:>12}: {driver.bus.transactions:5d} I2C writes, {driver.bus.commands:3d} commands, "
+              f"{driver.bus.data_bytes:4d} chars, {driver.bus.controller_delay * 1000:.0f} ms clear delay")
@@ -0,0 +1,113 @@
+"""
+AttendanceLedger class definition
+Local per-day record of the last attendance action of every user
+
+Damiano Milani
+2025
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from eventlog import EventLog
+
+
+def normalize_timestamp(ts):
+    """Return ts as a naive UTC ISO string so that local and server timestamps compare correctly."""
+    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(timespec="microseconds")
+
+
+class AttendanceLedger:
+    def __init__(self, path, log=None):
+        self.log = log or EventLog()
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.cutoff = None
+        self.entries = {}
+        self.watermark = None
+        self.seeded = False
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            self.cutoff = state["cutoff"]
+            self.entries = state["entries"]
+            self.watermark = state.get("watermark")
+            # Only an offline fallback until the next full sync confirms it: scans made
+            # on other devices while this one was down are not in the file.
+            self.log.info("ledger", "Ledger loaded, unconfirmed until the next sync", users=len(self.entries), day=self.cutoff)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.log.warn("ledger", "Ignoring unreadable ledger file", error=e)
+
+    def save(self):
+        # Called from the scan path and the sync thread: one writer of the temporary file at a time
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                state = {"cutoff": self.cutoff, "entries": dict(self.entries), "watermark": self.watermark}
+                self.dirty = False
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                with self.lock:
+                    self.dirty = True  # Try again on the next save
+                raise
+
+    def is_current(self, cutoff):
+        with self.lock:
+            return self.seeded and self.cutoff == cutoff
+
+    def reset(self, cutoff):
+        """Start a new day: forget all entries and wait for the next seed."""
+        with self.lock:
+            self.cutoff = cutoff
+            self.entries = {}
+            self.watermark = None
+            self.seeded = False
+            self.dirty = True
+
+    def last_action(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+        return entry["action"] if entry else None
+
+    def record(self, user_id, action, timestamp):
+        ts = normalize_timestamp(timestamp)
+        with self.lock:
+            if self.cutoff is None or ts < normalize_timestamp(self.cutoff):
+                return
+            entry = self.entries.get(user_id)
+            if entry is None or ts >= entry["timestamp"]:
+                self.entries[user_id] = {"action": action, "timestamp": ts}
+                self.dirty = True
+
+    def apply_rows(self, rows, cutoff, full=False):
+        """Merge server rows (user_id, action, timestamp) fetched since the watermark."""
+        with self.lock:
+            if self.cutoff != cutoff:
+                return
+        for row in rows:
+            self.record(row["user_id"], row["action"], row["timestamp"])
+            ts = normalize_timestamp(row["timestamp"])
+            with self.lock:
+                if self.watermark is None or ts > self.watermark:
+                    self.watermark = ts
+        with self.lock:
+            if full:
+                self.seeded = True
+            self.dirty = True
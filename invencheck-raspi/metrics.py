@@ -0,0 +1,243 @@
+"""
+Runtime metrics for the InvenCheck daemon
+Throughput meter, latency histograms and event counters for badge scans
+
+Damiano Milani
+2025
+"""
+
+import math
+import random
+import threading
+import time
+from collections import deque
+
+
+class ThroughputMeter:
+    def __init__(self, window=60):
+        self.window = window
+        self.lock = threading.Lock()
+        self.completions = deque()
+        self.latencies = deque()
+        self.total = 0
+        self.peak_per_minute = 0.0
+
+    def mark(self, started_at, now=None):
+        """Record a scan that started at started_at (monotonic) and completed now."""
+        now = now or time.monotonic()
+        with self.lock:
+            self.total += 1
+            self.completions.append(now)
+            self.latencies.append(now - started_at)
+            self._expire(now)
+            self.peak_per_minute = max(self.peak_per_minute, self._rate())
+
+    def _expire(self, now):
+        while self.completions and now - self.completions[0] > self.window:
+            self.completions.popleft()
+            self.latencies.popleft()
+
+    def _rate(self):
+        return len(self.completions) * 60.0 / self.window
+
+    def snapshot(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            latencies = sorted(self.latencies)
+            return {
+                "total": self.total,
+                "per_minute": self._rate(),
+                "peak_per_minute": self.peak_per_minute,
+                "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+                "latency_max": latencies[-1] if latencies else None,
+            }
+
+
+class LatencyWindow:
+    """Bounded sample of latencies since the last drain (reservoir sampling)."""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = []
+        self.seen = 0
+
+    def add(self, value):
+        with self.lock:
+            self.seen += 1
+            if len(self.samples) < self.size:
+                self.samples.append(value)
+            else:
+                slot = random.randrange(self.seen)
+                if slot < self.size:
+                    self.samples[slot] = value
+
+    def drain(self):
+        """Return (count, p50, p95) and start a new window."""
+        with self.lock:
+            samples, seen = sorted(self.samples), self.seen
+            self.samples, self.seen = [], 0
+        if not samples:
+            return seen, None, None
+        return seen, percentile(samples, 50), percentile(samples, 95)
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LogHistogram:
+    """
+    Fixed-memory latency histogram with logarithmic buckets (HDR-style).
+    Buckets grow by 2**(1/4), so any reported percentile is within ~19% of the
+    true value, from 10 us up to ~100 s. Recording costs about a microsecond.
+    """
+
+    MIN_VALUE = 1e-5
+    BUCKETS_PER_OCTAVE = 4
+    BUCKET_COUNT = 96
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_of(cls, value):
+        if value <= cls.MIN_VALUE:
+            return 0
+        index = int(math.log2(value / cls.MIN_VALUE) * cls.BUCKETS_PER_OCTAVE) + 1
+        return min(index, cls.BUCKET_COUNT - 1)
+
+    @classmethod
+    def upper_bound(cls, index):
+        return cls.MIN_VALUE * 2 ** (index / cls.BUCKETS_PER_OCTAVE)
+
+    def record(self, value):
+        index = self.bucket_of(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, pct, counts=None, count=None, maximum=None):
+        if counts is None:
+            with self.lock:
+                counts, count, maximum = list(self.counts), self.count, self.max
+        if not count:
+            return None
+        target = max(1, math.ceil(pct / 100.0 * count))
+        seen = 0
+        for index, bucket in enumerate(counts):
+            seen += bucket
+            if seen >= target:
+                return min(self.upper_bound(index), maximum)
+        return maximum
+
+    def snapshot(self):
+        """Cumulative statistics since startup (values in seconds)."""
+        with self.lock:
+            counts, count, total, maximum = list(self.counts), self.count, self.total, self.max
+        return {
+            "count": count,
+            "sum": total,
+            "max": maximum,
+            "p50": self.percentile(50, counts, count, maximum),
+            "p95": self.percentile(95, counts, count, maximum),
+            "p99": self.percentile(99, counts, count, maximum),
+            "buckets": counts,
+        }
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.monotonic() - self.start)
+        return False
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name):
+    hist = _histograms.get(name)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(name, LogHistogram())
+    return hist
+
+
+def observe(name, seconds):
+    histogram(name).record(seconds)
+
+
+def timed(name):
+    """Context manager recording the duration of its block in the named histogram."""
+    return _Timer(histogram(name))
+
+
+def histograms():
+    with _histograms_lock:
+        return dict(_histograms)
+
+
+def format_ms(seconds):
+    if seconds is None:
+        return "-"
+    ms = seconds * 1000
+    if ms < 1:
+        return f"{ms:.2f}"
+    return f"{ms:.1f}" if ms < 10 else f"{ms:.0f}"
+
+
+def latency_summary():
+    """One line per instrumented stage: count, p50, p95, p99 and max in ms."""
+    lines = []
+    for name, hist in sorted(histograms().items()):
+        stats = hist.snapshot()
+        lines.append(
+            f"{name}: n={stats['count']} p50={format_ms(stats['p50'])} p95={format_ms(stats['p95'])} "
+            f"p99={format_ms(stats['p99'])} max={format_ms(stats['max'])} ms"
+        )
+    return lines
+
+
+def latency_screens(rows=4):
+    """20x4 LCD pages with p50/p95 (ms) of every instrumented stage."""
+    entries = []
+    for name, hist in sorted(histograms().items()):
+        stats = hist.snapshot()
+        entries.append(f"{name[:9]:<9}{format_ms(stats['p50']):>5}{format_ms(stats['p95']):>6}")
+    screens = []
+    per_screen = rows - 1
+    for i in range(0, len(entries), per_screen):
+        screens.append(["LATENCY ms  p50  p95"] + entries[i:i + per_screen])
+    return screens
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def increment(name, amount=1):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counters():
+    with _counters_lock:
+        return dict(_counters)
@@ -2,26 +2,257 @@
 NFCReader class definition
 PN532 NFC reader connected to a Raspberry Pi via SPI
 
+The reader leaves an InListPassiveTarget command armed on the PN532, which keeps
+polling the RF field by itself. The host only checks whether the answer is
+ready: on the IRQ pin when it is wired (no SPI traffic at all), otherwise over
+SPI, continuously at peak hours and at a low duty cycle when the site is quiet.
+
+Several readers can share an SPI bus, each on its own chip select: their SPI
+transactions are serialized on the bus lock, and they only hold it for single
+status checks so that one reader never stalls the others.
+
 Damiano Milani
 2025
 """
 
-import board
-import busio
-from digitalio import DigitalInOut
-from adafruit_pn532.spi import PN532_SPI
+import threading
+import time
+from datetime import datetime
+
+_COMMAND_RFCONFIGURATION = 0x32
+_COMMAND_INLISTPASSIVETARGET = 0x4A
+_CFG_MAX_RETRIES = 0x05
+_MIFARE_ISO14443A = 0x00
+
+# SCK, MOSI, MISO of the Raspberry Pi SPI controllers (SPI1 needs dtoverlay=spi1-3cs)
+SPI_BUS_PINS = {
+    "spi0": ("SCK", "MOSI", "MISO"),
+    "spi1": ("SCK_1", "MOSI_1", "MISO_1"),
+}
+DIRECTIONS = {"in": "check_in", "out": "check_out"}
+
+
+def parse_readers(spec):
+    """
+    Parse "name:cs_pin:irq_pin:bus:direction" items separated by commas, e.g.
+    "entry:D8:25::in,exit:D7:24::out". Empty fields keep the defaults, and the
+    direction (in/out) forces the action recorded by that reader.
+    """
+    readers = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        fields = (item.split(":") + [""] * 5)[:5]
+        name, cs_pin, irq_pin, bus, direction = (field.strip() for field in fields)
+        if direction and direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction '{direction}' for reader '{name}' (expected in or out)")
+        if bus and bus not in SPI_BUS_PINS:
+            raise ValueError(f"Unknown SPI bus '{bus}' for reader '{name}'")
+        readers.append({
+            "name": name,
+            "cs_pin": cs_pin or "D8",
+            "irq_pin": int(irq_pin) if irq_pin else None,
+            "bus": bus or "spi0",
+            "direction": direction or None,
+        })
+    return readers
+
+
+class SPIBus:
+    _buses = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()  # One chip select asserted at a time
+        self.readers = 0
+        self._spi = None
+
+    @classmethod
+    def get(cls, name):
+        with cls._registry_lock:
+            if name not in cls._buses:
+                cls._buses[name] = cls(name)
+            return cls._buses[name]
+
+    @property
+    def shared(self):
+        return self.readers > 1
+
+    def spi(self):
+        # A single busio.SPI per bus: its try_lock alone is not thread-safe
+        if self._spi is None:
+            import board
+            import busio
+            sck, mosi, miso = SPI_BUS_PINS[self.name]
+            self._spi = busio.SPI(getattr(board, sck), getattr(board, mosi), getattr(board, miso))
+        return self._spi
+
+
+class PollSchedule:
+    def __init__(self, peak_hours=(), idle_interval=0.5, hold=120):
+        """
+        peak_hours is a list of (start, end) minutes after local midnight. Outside
+        of them, and once hold seconds have passed since the last scan, the status
+        of the PN532 is only checked every idle_interval seconds.
+        """
+        self.peak_hours = list(peak_hours)
+        self.idle_interval = idle_interval
+        self.hold = hold
+
+    @staticmethod
+    def parse(spec):
+        """Parse "07:00-09:30,12:00-14:00" into [(420, 570), (720, 840)]."""
+        ranges = []
+        for item in (spec or "").split(","):
+            item = item.strip()
+            if not item:
+                continue
+            start, end = item.split("-")
+            sh, sm = (int(x) for x in start.split(":"))
+            eh, em = (int(x) for x in end.split(":"))
+            ranges.append((sh * 60 + sm, eh * 60 + em))
+        return ranges
+
+    def is_peak(self, now=None):
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        return any(start <= minute < end for start, end in self.peak_hours)
+
+    def pause(self, since_last_scan, now=None):
+        """Seconds to wait between two status checks (0 means poll continuously)."""
+        if since_last_scan < self.hold or self.is_peak(now):
+            return 0.0
+        return self.idle_interval
+
+
+class IrqLine:
+    def __init__(self, bcm_pin):
+        """PN532 P32/IRQ input, active low, with a blocking wait for its falling edge."""
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = bcm_pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(bcm_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+    @property
+    def value(self):
+        return bool(self.GPIO.input(self.pin))
+
+    def wait_low(self, timeout):
+        """Sleep in the kernel until the line goes low or timeout seconds pass."""
+        if not self.value:
+            return True
+        channel = self.GPIO.wait_for_edge(self.pin, self.GPIO.FALLING, timeout=max(1, int(timeout * 1000)))
+        # An edge between the level check and the wait is caught by the next level check
+        return channel is not None or not self.value
+
 
 class NFCReader:
-    def __init__(self):
-        spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
-        cs_pin = DigitalInOut(board.D8)  # CE0
-        self.pn532 = PN532_SPI(spi, cs_pin, debug=False)
-        self.pn532.SAM_configuration()
-        print("[INIT] PN532 ready")
+    def __init__(self, cs_pin="D8", irq_pin=None, spi_baudrate=1_000_000, max_retries=0xFF,
+                 schedule=None, backend=None, irq=None, rearm_interval=30, name="", bus="spi0", direction=None):
+        """
+        backend/irq replace the PN532_SPI driver and the IrqLine, e.g. with
+        pn532_mock.SimulatedPN532 and its irq pin.
+        max_retries is MxRtyPassiveActivation: 0xFF lets the PN532 retry forever.
+        name and direction (None, "in" or "out") identify the lane of the reader.
+        """
+        self.name = name
+        self.direction = direction
+        self.bus = SPIBus.get(bus)
+        self.bus.readers += 1
+        if backend is None:
+            import board
+            from digitalio import DigitalInOut
+            from adafruit_pn532.spi import PN532_SPI
+
+            cs = DigitalInOut(getattr(board, cs_pin))  # CE0 by default
+            if irq_pin is not None:
+                irq = IrqLine(irq_pin)  # Waited on here; the SPI driver reads the status byte itself
+            with self.bus.lock:
+                backend = PN532_SPI(self.bus.spi(), cs, debug=False)
+        self.pn532 = backend
+        self.irq = irq
+        self.schedule = schedule or PollSchedule()
+        self.rearm_interval = rearm_interval
+        self.armed_at = None
+        self.last_read = float("-inf")
+        self.last_detection = None  # Duration of the readout that found the last tag
+
+        # PN532 accepts SPI clocks up to 5 MHz; the driver defaults to 1 MHz
+        self.pn532._spi.baudrate = spi_baudrate
+        with self.bus.lock:
+            self.pn532.SAM_configuration()  # Also routes "response ready" to the IRQ pin
+        self.configure_retries(max_retries)
+        mode = "IRQ" if irq is not None else "polling"
+        label = f"PN532 '{name}'" if name else "PN532"
+        print(f"[INIT] {label} ready ({mode}, {bus} CS {cs_pin}, SPI {spi_baudrate // 1000} kHz, "
+              f"MxRtyPassiveActivation 0x{max_retries:02X})")
+
+    def configure_retries(self, passive_activation, atr=0xFF, psl=0x01):
+        """RFConfiguration CfgItem 5: MxRtyATR, MxRtyPSL, MxRtyPassiveActivation."""
+        with self.bus.lock:
+            self.pn532.call_function(_COMMAND_RFCONFIGURATION, params=[_CFG_MAX_RETRIES, atr, psl, passive_activation])
+        self.armed_at = None
+
+    def _arm(self, timeout):
+        with self.bus.lock:
+            armed = self.pn532.send_command(_COMMAND_INLISTPASSIVETARGET, params=[0x01, _MIFARE_ISO14443A], timeout=timeout)
+        if armed:
+            self.armed_at = time.monotonic()
+            return True
+        return False
+
+    def _wait_irq(self, timeout):
+        # The IRQ line is active low; waiting on it costs no SPI transfer
+        if hasattr(self.irq, "wait_low"):
+            return self.irq.wait_low(timeout)
+        # A plain input without edge detection: sample it at the pace of the schedule
+        deadline = time.monotonic() + timeout
+        while self.irq.value:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.schedule.pause(time.monotonic() - self.last_read) or 0.01)
+        return True
+
+    def _response(self, timeout):
+        """The InListPassiveTarget answer if ready within timeout: a UID, b"" if no tag, None if not ready."""
+        with self.bus.lock:
+            response = self.pn532.process_response(_COMMAND_INLISTPASSIVETARGET, response_length=64, timeout=timeout)
+        if response is None:
+            return None
+        self.armed_at = None
+        if response[0] == 0:  # NbTg: MxRtyPassiveActivation exhausted without a tag
+            return b""
+        return response[6:6 + response[5]]
 
     def read_uid(self, timeout=1.0):
         while True:
-            uid = self.pn532.read_passive_target(timeout=timeout)
+            if self.armed_at is None or time.monotonic() - self.armed_at > self.rearm_interval:
+                if not self._arm(timeout):
+                    time.sleep(0.1)
+                    continue
+
+            if self.irq is not None:
+                if not self._wait_irq(timeout):
+                    continue
+                wait = timeout
+            else:
+                pause = self.schedule.pause(time.monotonic() - self.last_read)
+                if pause:
+                    time.sleep(pause)
+                    wait = 0.001  # A single status check
+                elif self.bus.shared:
+                    wait = 0.001  # Let the other readers of the bus in between checks
+                else:
+                    wait = timeout
+
+            started = time.monotonic()
+            uid = self._response(wait)
+            if uid is None and self.bus.shared:
+                time.sleep(0.005)  # Locks are not fair: release the bus long enough for the others
             if uid:
+                self.last_detection = time.monotonic() - started
+                self.last_read = time.monotonic()
                 return ''.join('{:02X}'.format(x) for x in uid)
-            
\ No newline at end of file
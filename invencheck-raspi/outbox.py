@@ -0,0 +1,204 @@
+"""
+Outbox class definition
+Durable on-device queue for attendance writes (SQLite)
+
+Damiano Milani
+2025
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+from eventlog import EventLog
+
+
+class Outbox:
+    def __init__(self, path, sender, batch_size=50, batch_delay=0.5, base_backoff=2, max_backoff=300, max_attempts=20,
+                 log=None):
+        """
+        sender(payloads) receives a list of rows and must return True when all of
+        them have been stored remotely, False when the server rejected the batch,
+        and raise RequestException on network or server-side errors.
+        Every payload carries a "client_id" UUID fixed at enqueue time, so that the
+        sender can make a retry after a lost response a no-op on the server.
+        """
+        self.log = log or EventLog()
+        self.path = path
+        self.sender = sender
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.failures = 0
+        self.retry_at = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL + synchronous=NORMAL: commits are durable against process crashes and
+        # the WAL is fsynced at checkpoint time, not on every enqueue (SD card wear).
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL DEFAULT 0,"
+            " last_error TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_dead ("
+            " id INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " last_error TEXT)"
+        )
+        self._assign_client_ids()
+        self.log.info("outbox", "Outbox ready", pending=self.depth())
+
+    def start(self):
+        threading.Thread(target=self._flusher_loop, name="outbox", daemon=True).start()
+
+    def _assign_client_ids(self):
+        """Give rows queued by an older version their client_id before they are sent."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, payload FROM outbox").fetchall()
+            updates = []
+            for row_id, raw in rows:
+                payload = json.loads(raw)
+                if "client_id" not in payload:
+                    payload["client_id"] = str(uuid.uuid4())
+                    updates.append((json.dumps(payload), row_id))
+            if updates:
+                self.db.executemany("UPDATE outbox SET payload = ? WHERE id = ?", updates)
+
+    def enqueue(self, payload):
+        payload.setdefault("client_id", str(uuid.uuid4()))
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO outbox (payload, created) VALUES (?, ?)",
+                (json.dumps(payload), time.time())
+            )
+        self.wakeup.set()
+
+    def depth(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def last_pending_action(self, user_id, since_iso):
+        """Most recent queued action for user_id with timestamp >= since_iso, or None."""
+        with self.lock:
+            rows = self.db.execute("SELECT payload FROM outbox ORDER BY id DESC").fetchall()
+        for (raw,) in rows:
+            payload = json.loads(raw)
+            if payload.get("user_id") == user_id and payload.get("timestamp", "") >= since_iso.rstrip("Z"):
+                return payload.get("action")
+        return None
+
+    def pending(self):
+        """Payloads still waiting to be sent, oldest first."""
+        with self.lock:
+            rows = self.db.execute("SELECT payload FROM outbox ORDER BY id").fetchall()
+        return [json.loads(raw) for (raw,) in rows]
+
+    def _next_due(self):
+        with self.lock:
+            return self.db.execute(
+                "SELECT created, next_attempt FROM outbox ORDER BY next_attempt, id LIMIT 1"
+            ).fetchone()
+
+    def _due_rows(self):
+        with self.lock:
+            return self.db.execute(
+                "SELECT id, payload, created, attempts FROM outbox WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+                (time.time(), self.batch_size)
+            ).fetchall()
+
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** min(attempts, 16)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _mark_rejected(self, row_id, attempts, error):
+        with self.lock:
+            self.db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + self._backoff(attempts), error, row_id)
+            )
+
+    def _move_to_dead(self, row_id, payload, created, attempts, error):
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "INSERT OR REPLACE INTO outbox_dead (id, payload, created, attempts, last_error) VALUES (?, ?, ?, ?, ?)",
+                (row_id, payload, created, attempts, error)
+            )
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            self.db.execute("COMMIT")
+
+    def _delete(self, rows):
+        with self.lock:
+            self.db.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+
+    def _deliver(self, rows):
+        """Send rows as one array insert; on rejection split the batch to isolate the bad rows."""
+        if self.sender([json.loads(row[1]) for row in rows]):
+            self._delete(rows)
+            return len(rows)
+
+        if len(rows) > 1:
+            mid = len(rows) // 2
+            return self._deliver(rows[:mid]) + self._deliver(rows[mid:])
+
+        row_id, raw, created, attempts = rows[0]
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self.log.error("outbox", "Row rejected too many times, moved to dead letters", row=row_id, attempts=attempts)
+            self._move_to_dead(row_id, raw, created, attempts, "rejected by server")
+        else:
+            self._mark_rejected(row_id, attempts, "rejected by server")
+        return 0
+
+    def _flusher_loop(self):
+        while True:
+            head = self._next_due()
+            if head is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            created, next_attempt = head
+            now = time.time()
+            wait = max(next_attempt, self.retry_at) - now
+            # Give a burst of scans a moment to accumulate into a single request
+            if wait <= 0 and self.depth() < self.batch_size:
+                wait = created + self.batch_delay - now
+            if wait > 0:
+                self.wakeup.wait(wait)
+                self.wakeup.clear()
+                continue
+
+            rows = self._due_rows()
+            if not rows:
+                continue
+            try:
+                sent = self._deliver(rows)
+            except requests.exceptions.RequestException as e:
+                # Network down: pause the whole queue (order is preserved) and back off.
+                self.failures += 1
+                self.retry_at = time.time() + self._backoff(self.failures)
+                self.log.warn("outbox", "Network error, retrying later", pending=self.depth(), error=e)
+                continue
+
+            self.failures = 0
+            if sent:
+                self.log.debug("outbox", "Rows synced", sent=sent, pending=self.depth())
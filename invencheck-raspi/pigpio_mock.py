@@ -0,0 +1,117 @@
+"""
+Mock pigpio backend
+Drop-in replacement for the subset of the pigpio module used by Buzzer, with
+simulated waveform timing. Lets the playback engine run without pigpiod.
+
+Damiano Milani
+2025
+"""
+
+import threading
+import time
+from collections import deque
+
+OUTPUT = 1
+WAVE_CHAIN_MAX = 600
+
+
+class pulse:
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+
+class pi:
+    def __init__(self, host=None, port=None):
+        self.connected = True
+        self.lock = threading.Lock()
+        self.modes = {}
+        self.levels = {}
+        self.pending_pulses = []
+        self.waves = {}  # wave id -> duration in microseconds
+        self.next_wave_id = 0
+        self.busy_until = 0.0
+        self.played = deque(maxlen=1000)  # (monotonic start, duration in seconds, chain)
+        self.stops = 0
+        self.calls = 0
+
+    def set_mode(self, gpio, mode):
+        self.calls += 1
+        self.modes[gpio] = mode
+
+    def write(self, gpio, level):
+        self.calls += 1
+        self.levels[gpio] = level
+
+    def hardware_PWM(self, gpio, frequency, dutycycle):
+        self.calls += 1
+        self.levels[gpio] = frequency
+
+    def wave_clear(self):
+        self.calls += 1
+        self.pending_pulses = []
+        self.waves = {}
+
+    def wave_add_generic(self, pulses):
+        self.calls += 1
+        self.pending_pulses.extend(pulses)
+        return len(self.pending_pulses)
+
+    def wave_create(self):
+        self.calls += 1
+        wave_id = self.next_wave_id
+        self.next_wave_id += 1
+        self.waves[wave_id] = sum(p.delay for p in self.pending_pulses)
+        self.pending_pulses = []
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        self.calls += 1
+        self.waves.pop(wave_id, None)
+
+    def _chain_duration(self, chain, i=0):
+        """Interpret a wave chain and return (duration in microseconds, next index)."""
+        total = 0
+        while i < len(chain):
+            if chain[i] != 255:
+                total += self.waves[chain[i]]
+                i += 1
+                continue
+            command = chain[i + 1]
+            if command == 0:  # loop start
+                body, i = self._chain_duration(chain, i + 2)
+                count = chain[i + 2] + 256 * chain[i + 3]
+                total += body * count
+                i += 4
+            elif command == 1:  # loop end: hand back to the loop start
+                return total, i
+            elif command == 2:  # delay
+                total += chain[i + 2] + 256 * chain[i + 3]
+                i += 4
+            else:
+                raise ValueError(f"Unsupported chain command {command}")
+        return total, i
+
+    def wave_chain(self, chain):
+        self.calls += 1
+        if len(chain) > WAVE_CHAIN_MAX:
+            raise ValueError("Chain too long")
+        duration = self._chain_duration(list(chain))[0] / 1_000_000
+        with self.lock:
+            now = time.monotonic()
+            self.busy_until = now + duration
+            self.played.append((now, duration, list(chain)))
+
+    def wave_tx_busy(self):
+        return time.monotonic() < self.busy_until
+
+    def wave_tx_stop(self):
+        self.calls += 1
+        with self.lock:
+            if time.monotonic() < self.busy_until:
+                self.stops += 1
+            self.busy_until = 0.0
+
+    def stop(self):
+        self.connected = False
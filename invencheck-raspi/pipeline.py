@@ -0,0 +1,135 @@
+"""
+ScanPipeline class definition
+Staged processing of badge scans connected by queues, one thread per stage
+
+Damiano Milani
+2025
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import metrics
+from eventlog import EventLog
+
+
+class _StageTimer:
+    __slots__ = ("event", "name", "start")
+
+    def __init__(self, event, name):
+        self.event = event
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.monotonic() - self.start
+        self.event.stages[self.name] = elapsed
+        metrics.observe(self.name, elapsed)
+        return False
+
+
+class ScanEvent:
+    def __init__(self, uid, detected_at=None, reader=None):
+        self.uid = uid
+        self.detected_at = detected_at or time.monotonic()
+        self.reader = reader  # NFCReader that read the tag, for its lane name and direction
+        self.user_id = None
+        self.action = None
+        self.timestamp = None
+        self.feedback = None  # callable run by the feedback stage
+        self.final = True  # False for intermediate acknowledgements (e.g. the read beep)
+        self.outcome = None  # check_in, check_out, unknown, diagnostic, egg, db_error, network_error, error
+        self.stages = {}  # stage name -> seconds, for this scan only
+
+    def timed(self, name):
+        """Time a block both for this scan and in the shared latency histogram."""
+        return _StageTimer(self, name)
+
+
+class ScanDebouncer:
+    def __init__(self, window=3.0, size=32):
+        """Ring buffer of recent (uid, monotonic_time, action) reads."""
+        self.window = window
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=size)
+
+    def _find(self, uid):
+        for entry in reversed(self.recent):
+            if entry[0] == uid:
+                return entry
+        return None
+
+    def check(self, uid, now=None):
+        """
+        Return the recent entry when uid was already read within the window, else
+        record the read and return None. A suppressed read extends the window, so
+        a card left on the reader stays suppressed.
+        """
+        now = now or time.monotonic()
+        with self.lock:
+            entry = self._find(uid)
+            if entry is not None and now - entry[1] < self.window:
+                previous = tuple(entry)
+                entry[1] = now
+                return previous
+            self.recent.append([uid, now, None])
+        return None
+
+    def set_action(self, uid, action):
+        with self.lock:
+            entry = self._find(uid)
+            if entry is not None:
+                entry[2] = action
+
+
+class Stage:
+    def __init__(self, name, handler, on_error=None, maxsize=0, log=None):
+        """
+        handler(event) returns the event to hand to the next stage, or None
+        when processing of that scan ends here.
+        """
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.log = log or EventLog()
+        self.queue = queue.Queue(maxsize)
+        self.next_stage = None
+
+    def put(self, event):
+        self.queue.put(event)
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"stage-{self.name}", daemon=True).start()
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                result = self.handler(event)
+            except Exception as e:
+                self.log.error("scan", "Stage failed", stage=self.name, uid=event.uid, error=e)
+                result = self.on_error(event, e) if self.on_error else None
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+
+
+class ScanPipeline:
+    def __init__(self, *stages):
+        self.stages = stages
+        for current, following in zip(stages, stages[1:]):
+            current.next_stage = following
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, event):
+        self.stages[0].put(event)
+
+    def depth(self):
+        return sum(stage.queue.qsize() for stage in self.stages)
@@ -0,0 +1,283 @@
+"""
+Mock PN532 backend
+Simulated PN532 on SPI with the subset of the adafruit_pn532 API used by
+NFCReader. Tags arrive on a script or on demand, the IRQ line and the status
+byte follow the answers the chip would have ready, and every SPI transfer is
+counted and charged the CPU time of a spidev ioctl.
+
+Damiano Milani
+2025
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+_COMMAND_SAMCONFIGURATION = 0x14
+_COMMAND_RFCONFIGURATION = 0x32
+_COMMAND_INLISTPASSIVETARGET = 0x4A
+
+
+class _SPIDevice:
+    def __init__(self):
+        self.baudrate = 1_000_000
+
+
+class _IrqPin:
+    def __init__(self, chip):
+        self.chip = chip
+
+    @property
+    def value(self):
+        # Active low: pulled down while an answer is waiting to be read
+        if self.chip.closed:
+            raise RuntimeError("PN532 closed")
+        return not self.chip.response_ready()
+
+    def wait_low(self, timeout):
+        """Edge wait like IrqLine: sleep until the armed answer is ready, a tag arrives or timeout."""
+        deadline = time.monotonic() + timeout
+        with self.chip.changed:
+            while True:
+                if self.chip.closed:
+                    raise RuntimeError("PN532 closed")
+                ready, _ = self.chip._answer()
+                now = time.monotonic()
+                if ready is not None and now >= ready:
+                    return True
+                if now >= deadline:
+                    return False
+                self.chip.changed.wait((deadline if ready is None else min(ready, deadline)) - now)
+
+
+class SimulatedPN532:
+    ACK_DELAY = 0.001  # The PN532 acknowledges a frame within about a millisecond
+    ACTIVATION_TIME = 0.015  # Time to activate an ISO14443A tag once it is in the field
+    RETRY_PERIOD = 0.01  # Duration of one passive activation attempt without a tag
+    TRANSACTION_CPU = 60e-6  # Host CPU spent per SPI transfer (ioctl + Python driver)
+
+    def __init__(self, arrivals=(), dwell=0.5):
+        """arrivals is a list of (seconds from now, uid hex string)."""
+        self._spi = _SPIDevice()
+        self.irq = _IrqPin(self)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()  # Notified when the field or the armed command changes
+        self.dwell = dwell
+        self.max_retries = 0xFF
+        self.cards = []  # [arrival, departure, uid bytes, detected]
+        self.command_at = None
+        self.transactions = 0
+        self.bus_time = 0.0
+        self.detections = deque(maxlen=10000)  # (arrival, detection time, uid), first read of every arrival
+        self.closed = False
+        start = time.monotonic()
+        for offset, uid in arrivals:
+            self.present(uid, at=start + offset)
+
+    # --- Scenario ---
+    def present(self, uid, at=None, dwell=None):
+        """Put a tag in the field at monotonic time at (now by default)."""
+        now = time.monotonic()
+        arrival = now if at is None else at
+        with self.lock:
+            # Forget tags that left the field long ago, long simulations stay bounded
+            self.cards = [card for card in self.cards if card[1] > now - 1.0]
+            self.cards.append([arrival, arrival + (dwell or self.dwell), bytes.fromhex(uid), False])
+            self.cards.sort(key=lambda card: card[0])
+        self._notify()
+
+    def _notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def play(self, arrivals):
+        """Present the tags of an (offset in seconds, uid) iterable, possibly endless, on a background thread."""
+        def run():
+            start = time.monotonic()
+            for offset, uid in arrivals:
+                delay = start + offset - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if self.closed:
+                    return
+                self.present(uid)
+        threading.Thread(target=run, name="pn532-sim", daemon=True).start()
+
+    @staticmethod
+    def poisson_arrivals(rate_per_minute, uids, seed=None, min_gap=1.0):
+        """Endless random arrivals at rate_per_minute on average."""
+        rng = random.Random(seed)
+        mean_gap = max(0.001, 60.0 / rate_per_minute - min_gap)
+        offset = 0.0
+        while True:
+            offset += min_gap + rng.expovariate(1.0 / mean_gap)
+            yield offset, rng.choice(uids)
+
+    @staticmethod
+    def load_script(path):
+        """Read "offset_seconds uid" lines; blank lines and # comments are skipped."""
+        arrivals = []
+        with open(path, "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    offset, uid = line.replace(",", " ").split()[:2]
+                    arrivals.append((float(offset), uid))
+        return sorted(arrivals)
+
+    @staticmethod
+    def random_arrivals(count, mean_gap, uids, seed=None, min_gap=1.0):
+        """Poisson arrivals, at least min_gap apart so that two tags are never in the field together."""
+        rng = random.Random(seed)
+        offset = 0.0
+        arrivals = []
+        for _ in range(count):
+            offset += min_gap + rng.expovariate(1.0 / mean_gap)
+            arrivals.append((offset, rng.choice(uids)))
+        return arrivals
+
+    # --- Chip model ---
+    def _answer(self):
+        """(ready at, card) for the armed InListPassiveTarget; card None means NbTg = 0."""
+        if self.command_at is None:
+            return None, None
+        armed = self.command_at + self.ACK_DELAY
+        with self.lock:
+            for card in self.cards:
+                if card[1] > armed:
+                    ready = max(armed, card[0]) + self.ACTIVATION_TIME
+                    if ready < card[1]:
+                        break
+            else:
+                card, ready = None, None
+        if self.max_retries != 0xFF:
+            give_up = armed + (self.max_retries + 1) * self.RETRY_PERIOD
+            if ready is None or give_up < ready:
+                return give_up, None
+        return ready, card
+
+    def response_ready(self):
+        ready, _ = self._answer()
+        return ready is not None and time.monotonic() >= ready
+
+    def close(self):
+        """Make every further access fail, which ends the reader threads using it."""
+        self.closed = True
+        self._notify()
+
+    def _transaction(self, length):
+        if self.closed:
+            raise RuntimeError("PN532 closed")
+        self.transactions += 1
+        self.bus_time += length * 8 / self._spi.baudrate
+        end = time.perf_counter() + self.TRANSACTION_CPU
+        while time.perf_counter() < end:
+            pass
+
+    def _wait_ready(self, ready, timeout):
+        # Same loop as PN532_SPI._wait_ready: a status read every 10 ms
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            self._transaction(2)
+            if ready():
+                return True
+            time.sleep(0.01)
+        return False
+
+    # --- adafruit_pn532 API ---
+    def send_command(self, command, params=b"", timeout=1):
+        self._transaction(8 + len(params))
+        sent = time.monotonic()
+        if command == _COMMAND_INLISTPASSIVETARGET:
+            self.command_at = sent  # A new command aborts the pending one
+            self._notify()
+        if not self._wait_ready(lambda: time.monotonic() >= sent + self.ACK_DELAY, timeout):
+            return False
+        self._transaction(6)  # ACK frame
+        return True
+
+    def process_response(self, command, response_length=0, timeout=1):
+        if command != _COMMAND_INLISTPASSIVETARGET:
+            self._transaction(response_length + 8)
+            return bytearray(response_length)
+        if not self._wait_ready(self.response_ready, timeout):
+            return None
+        _, card = self._answer()
+        self.command_at = None
+        self._transaction(response_length + 8)
+        if card is None:
+            return bytearray([0x00])
+        if not card[3]:
+            card[3] = True
+            self.detections.append((card[0], time.monotonic(), card[2].hex().upper()))
+        uid = card[2]
+        return bytearray([0x01, 0x01, 0x00, 0x04, 0x08, len(uid)]) + uid
+
+    def call_function(self, command, response_length=0, params=b"", timeout=1):
+        if command == _COMMAND_RFCONFIGURATION and params and params[0] == 0x05:
+            self.max_retries = params[3]
+        if not self.send_command(command, params=params, timeout=timeout):
+            return None
+        return self.process_response(command, response_length=response_length, timeout=timeout)
+
+    def SAM_configuration(self):
+        self.call_function(_COMMAND_SAMCONFIGURATION, params=[0x01, 0x14, 0x01])
+
+    def read_passive_target(self, card_baud=0x00, timeout=1):
+        if not self.send_command(_COMMAND_INLISTPASSIVETARGET, params=[0x01, card_baud], timeout=timeout):
+            return None
+        response = self.process_response(_COMMAND_INLISTPASSIVETARGET, response_length=64, timeout=timeout)
+        if not response or response[0] == 0:
+            return None
+        return response[6:6 + response[5]]
+
+
+if __name__ == "__main__":
+    # Detection latency, SPI traffic and CPU of the polling modes on the same arrivals
+    import statistics
+    from nfc import NFCReader, PollSchedule
+
+    def legacy_reader(chip):
+        # The previous NFCReader: read_passive_target(timeout=1.0) in a loop
+        try:
+            while True:
+                if chip.read_passive_target(timeout=1.0):
+                    time.sleep(0.25)
+        except RuntimeError:
+            pass  # Chip closed at the end of the run
+
+    arrivals = SimulatedPN532.random_arrivals(10, 0.8, ["04A1B2C3", "04D5E6F7", "0411223344"], seed=7)
+    duration = arrivals[-1][0] + 1.0
+
+    def run(label, make_reader):
+        chip = SimulatedPN532(arrivals)
+        loop = make_reader(chip)
+        chip.transactions = 0
+        cpu, wall = time.process_time(), time.monotonic()
+        threading.Thread(target=loop, daemon=True).start()
+        time.sleep(duration)
+        cpu, wall = time.process_time() - cpu, time.monotonic() - wall
+        chip.close()
+        time.sleep(0.5)
+        latencies = sorted((detected - arrival) * 1000 for arrival, detected, _ in chip.detections)
+        missed = len(arrivals) - len(latencies)
+        print(f"{label:>16}: latency avg {statistics.mean(latencies):5.1f} ms, max {latencies[-1]:5.1f} ms, "
+              f"{missed} missed, {chip.transactions / wall:6.1f} SPI transfers/s, CPU {100 * cpu / wall:4.1f}%")
+
+    def nfc_loop(reader):
+        def loop():
+            try:
+                while True:
+                    reader.read_uid()
+                    time.sleep(0.25)  # Same pause as the daemon's reader loop
+            except RuntimeError:
+                pass
+        return loop
+
+    # Each run on a bus of its own: the reader of a previous run would make the bus shared
+    run("legacy 1s poll", lambda chip: lambda: legacy_reader(chip))
+    run("adaptive peak", lambda chip: nfc_loop(NFCReader(backend=chip, schedule=PollSchedule([(0, 1440)]), bus="peak")))
+    run("adaptive idle", lambda chip: nfc_loop(NFCReader(backend=chip, schedule=PollSchedule(idle_interval=0.25, hold=0), bus="idle")))
+    run("IRQ", lambda chip: nfc_loop(NFCReader(backend=chip, irq=chip.irq, bus="irq")))
+    run("IRQ, MxRty 0x10", lambda chip: nfc_loop(NFCReader(backend=chip, irq=chip.irq, max_retries=0x10, bus="mxrty")))
@@ -0,0 +1,143 @@
+"""
+Scan-trace replay benchmark
+Replays a trace recorded with SCAN_TRACE_PATH through the whole daemon (simulated
+reader, decision, persistence and feedback stages) against SUPABASE_URL, and
+reports scan-to-feedback latency, throughput and Supabase request counts.
+
+    python replay.py trace.jsonl --speed 10
+
+Point SUPABASE_URL at a staging project, or use --standin to run against a
+local supabase_standin with optional injected faults: the replay writes
+attendance rows, and --seed-users also creates one user per replayed tag.
+
+    python replay.py trace.jsonl --speed 10 --standin --seed-users --latency lognormal:80:0.6
+
+Damiano Milani
+2025
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from metrics import percentile
+from supabase_standin import SupabaseStandIn, add_arguments, faults_from_args
+from tracing import load_trace
+
+REPLAY_OUTCOMES = ("check_in", "check_out")
+
+
+def synthetic_uid(uid_hash):
+    # 7-byte UID derived from the pseudonym: the same tag replays as the same tag
+    return uid_hash[:14].upper()
+
+
+def latency_line(label, values_ms):
+    if not values_ms:
+        return f"{label:<22} no samples"
+    values_ms = sorted(values_ms)
+    return (f"{label:<22} p50 {percentile(values_ms, 50):7.1f}  p95 {percentile(values_ms, 95):7.1f}  "
+            f"p99 {percentile(values_ms, 99):7.1f}  max {values_ms[-1]:7.1f} ms  (n={len(values_ms)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a scan trace through the InvenCheck daemon")
+    parser.add_argument("trace", help="JSONL trace recorded with SCAN_TRACE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (10 = ten times faster)")
+    parser.add_argument("--seed-users", action="store_true", help="Create a user for every tag that checked in/out")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds to let the daemon load its state")
+    parser.add_argument("--drain", type=float, default=30.0, help="Max seconds to wait for queues to empty")
+    parser.add_argument("--standin", action="store_true", help="Run against a local Supabase stand-in")
+    add_arguments(parser.add_argument_group("stand-in faults"))
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    if not trace:
+        sys.exit("Empty trace")
+    first = trace[0]["arrival"]
+    arrivals = [((record["arrival"] - first) / args.speed, synthetic_uid(record["uid"])) for record in trace]
+
+    # Fresh local state and simulated hardware; must be set before importing the daemon
+    workdir = tempfile.mkdtemp(prefix="invencheck-replay-")
+    script = os.path.join(workdir, "empty.script")
+    open(script, "w").close()
+    replay_trace = os.path.join(workdir, "replay.jsonl")
+    os.environ["INVENCHECK_HARDWARE"] = "sim"
+    os.environ["SIM_SCAN_SCRIPT"] = script
+    os.environ["INVENCHECK_DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ["SCAN_TRACE_PATH"] = replay_trace
+    os.environ.setdefault("LOG_SCAN_LEVEL", "WARN")
+    standin = None
+    if args.standin:
+        standin = SupabaseStandIn(api_key=os.getenv("SUPABASE_API_KEY"), faults=faults_from_args(args))
+        os.environ["SUPABASE_URL"] = standin.start()
+        os.environ.setdefault("SUPABASE_API_KEY", "replay")
+        print(f"[REPLAY] Supabase stand-in on {standin.url}")
+    # Compress the re-read window with time, or distinct taps of the same tag would be merged
+    os.environ["DEBOUNCE_WINDOW"] = str(float(os.getenv("DEBOUNCE_WINDOW", "3")) / args.speed)
+
+    import InvenCheck_main as daemon
+
+    requests_by_kind = Counter()
+    count_lock = threading.Lock()
+
+    def count(start, end, response):
+        table = urlparse(response.request.url).path.rsplit("/", 1)[-1] or "/"
+        with count_lock:
+            requests_by_kind[f"{response.request.method} {table}"] += 1
+
+    daemon.supabase.response_hooks.append(count)
+
+    if args.seed_users:
+        hashes = {record["uid"] for record in trace if record.get("outcome") in REPLAY_OUTCOMES}
+        rows = [{"uid": synthetic_uid(h), "user_id": f"replay-{h[:6]}"} for h in sorted(hashes)]
+        response = daemon.supabase.upsert(daemon.EMPLOYEES_TABLE, rows, on_conflict="uid")
+        print(f"[REPLAY] Seeded {len(rows)} users (HTTP {response.status_code})")
+
+    threading.Thread(target=daemon.main_loop, name="daemon", daemon=True).start()
+    time.sleep(args.warmup)
+
+    requests_before = daemon.supabase.request_count
+    requests_by_kind.clear()
+    chip = daemon.nfc_readers[0].pn532
+    chip.dwell = 0.3
+    started = time.monotonic()
+    print(f"[REPLAY] {len(arrivals)} scans over {arrivals[-1][0]:.1f} s at {args.speed:g}x")
+    chip.play(arrivals)
+    time.sleep(arrivals[-1][0] + 1.0)
+
+    deadline = time.monotonic() + args.drain
+    while time.monotonic() < deadline and (daemon.pipeline.depth() or daemon.outbox.depth()):
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+    daemon.tracer.flush()
+    requests = daemon.supabase.request_count - requests_before
+
+    replayed = load_trace(replay_trace) if os.path.exists(replay_trace) else []
+    scans = len(replayed)
+    print()
+    print(latency_line("replay scan->feedback", [r["total_ms"] for r in replayed if "total_ms" in r]))
+    print(latency_line("trace scan->feedback", [r["total_ms"] for r in trace if "total_ms" in r]))
+    stages = sorted({name for r in replayed for name in r["stages"]})
+    for name in stages:
+        print(latency_line(f"  {name}", [r["stages"][name] for r in replayed if name in r["stages"]]))
+    if scans > 1:
+        span = replayed[-1]["arrival"] - replayed[0]["arrival"]
+        print(f"throughput             {scans} scans in {span:.1f} s = {60 * scans / max(span, 0.001):.1f} scans/min")
+    print(f"outcomes               {dict(Counter(r['outcome'] for r in replayed))}")
+    print(f"debounced re-reads     {daemon.metrics.counters().get('scans_suppressed', 0)}")
+    print(f"supabase requests      {requests} in {elapsed:.1f} s, {requests / max(scans, 1):.2f} per scan, "
+          f"outbox backlog {daemon.outbox.depth()}")
+    for kind, n in requests_by_kind.most_common():
+        print(f"  {kind:<21}{n}")
+    if standin:
+        print(f"stand-in faults        {standin.faults.settings()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Roster class definition
+Employee tag roster held as an immutable snapshot, swapped atomically on refresh
+
+Damiano Milani
+2025
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from eventlog import EventLog
+
+
+class Roster:
+    def __init__(self, path=None, watermark_column="timestamp", log=None):
+        self.log = log or EventLog()
+        self.path = path
+        self.watermark_column = watermark_column
+        # Readers only ever dereference self.snapshot once per lookup; writers build a
+        # new dict and rebind the attribute, so a lookup never sees a half-built cache.
+        self.snapshot = MappingProxyType({})
+        self.watermark = None
+        self.last_sync = None
+        self.dirty = False
+        self.write_lock = threading.Lock()
+        self.negative = {}  # uid -> monotonic expiry of a confirmed "Unknown" answer
+        if path:
+            self._load()
+
+    def _load(self):
+        start = time.monotonic()
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+            self.snapshot = MappingProxyType({str(row["uid"]): row for row in state["rows"]})
+            self.watermark = state.get("watermark")
+            self.last_sync = state.get("last_sync")
+            self.log.info("roster", "Roster loaded from disk", tags=len(self.snapshot),
+                          ms=round((time.monotonic() - start) * 1000, 1))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.log.warn("roster", "Ignoring unreadable roster file", error=e)
+
+    def save(self):
+        if not self.path:
+            return
+        with self.write_lock:
+            if not self.dirty:
+                return
+            state = {
+                "watermark": self.watermark,
+                "last_sync": self.last_sync,
+                "rows": list(self.snapshot.values()),
+            }
+            # Write-then-rename so a power cut never leaves a truncated roster behind
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def get(self, uid):
+        return self.snapshot.get(str(uid))
+
+    def mark_unknown(self, uid, ttl):
+        self.negative[str(uid)] = time.monotonic() + ttl
+
+    def is_known_unknown(self, uid):
+        expiry = self.negative.get(str(uid))
+        return expiry is not None and time.monotonic() < expiry
+
+    def _max_watermark(self, rows, current=None):
+        values = [row.get(self.watermark_column) for row in rows]
+        values = [v for v in values if v] + ([current] if current else [])
+        return max(values) if values else None
+
+    def replace_all(self, rows):
+        """Full refresh: the new snapshot contains exactly these rows."""
+        snapshot = {str(row["uid"]): row for row in rows}
+        with self.write_lock:
+            self.snapshot = MappingProxyType(snapshot)
+            self.watermark = self._max_watermark(rows)
+            self.last_sync = time.time()
+            self.negative = {}
+            self.dirty = True
+        self.save()
+
+    def merge(self, rows):
+        """Delta refresh: rows changed since the watermark replace their old entries."""
+        with self.write_lock:
+            snapshot = dict(self.snapshot)
+            for row in rows:
+                snapshot[str(row["uid"])] = row
+                # A tag just assigned on the dashboard overrides any negative answer
+                if row.get("user_id") != "Unknown":
+                    self.negative.pop(str(row["uid"]), None)
+            self.snapshot = MappingProxyType(snapshot)
+            self.watermark = self._max_watermark(rows, self.watermark)
+            self.last_sync = time.time()
+            self.dirty = self.dirty or bool(rows)
+        self.save()
+
+    def put(self, employee):
+        """
+        Add a single row fetched or created outside a sync (cache miss, new unknown tag).
+        Only marks the roster dirty: the next sync or the shutdown save writes it to disk.
+        """
+        with self.write_lock:
+            snapshot = dict(self.snapshot)
+            snapshot[str(employee["uid"])] = employee
+            self.snapshot = MappingProxyType(snapshot)
+            self.dirty = True
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
@@ -0,0 +1,123 @@
+"""
+StatusServer class definition
+Optional LAN endpoint serving /metrics (Prometheus text exposition) and /status (JSON)
+
+Damiano Milani
+2025
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import metrics
+from eventlog import EventLog
+from metrics import LogHistogram
+
+PREFIX = "invencheck"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(status):
+    """
+    Text exposition of the counters, the latency histograms and the numeric
+    gauges in status["gauges"] (name -> value or {label tuple: value}).
+    """
+    lines = []
+    for name, value in sorted(metrics.counters().items()):
+        lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+        lines.append(f"{PREFIX}_{name}_total {value}")
+
+    # One exported bucket per octave: boundaries fall exactly on internal buckets
+    step = LogHistogram.BUCKETS_PER_OCTAVE
+    hists = sorted(metrics.histograms().items())
+    if hists:
+        lines.append(f"# TYPE {PREFIX}_stage_latency_seconds histogram")
+    for stage, hist in hists:
+        stats = hist.snapshot()
+        cumulative = 0
+        for index, count in enumerate(stats["buckets"]):
+            cumulative += count
+            if index % step == 0 and index < LogHistogram.BUCKET_COUNT - 1:
+                bound = LogHistogram.upper_bound(index)
+                lines.append(f'{PREFIX}_stage_latency_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{PREFIX}_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'{PREFIX}_stage_latency_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+        lines.append(f'{PREFIX}_stage_latency_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+    for name, value in sorted(status.get("gauges", {}).items()):
+        if value is None:
+            continue  # Not known yet (e.g. no heartbeat sent so far)
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        if isinstance(value, dict):
+            for labels, sample in sorted(value.items()):
+                label_text = ",".join(f'{key}="{_label_value(val)}"' for key, val in labels)
+                lines.append(f"{PREFIX}_{name}{{{label_text}}} {sample}")
+        else:
+            lines.append(f"{PREFIX}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class StatusServer:
+    def __init__(self, collect, host="0.0.0.0", port=9108, log=None):
+        """collect() returns the status dict; it is called once per request."""
+        self.log = log or EventLog()
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self.httpd = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            timeout = 5  # A stalled client must not hold the only thread
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                try:
+                    if path == "/metrics":
+                        body = render_prometheus(server.collect()).encode()
+                        content_type = "text/plain; version=0.0.4; charset=utf-8"
+                    elif path == "/status":
+                        status = server.collect()
+                        status.pop("gauges", None)  # Same values as the top-level fields
+                        status["latency"] = {
+                            name: {key: value for key, value in hist.snapshot().items() if key != "buckets"}
+                            for name, hist in metrics.histograms().items()
+                        }
+                        status["counters"] = metrics.counters()
+                        body = json.dumps(status, indent=2, default=str).encode()
+                        content_type = "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would flood the journal
+
+        try:
+            self.httpd = HTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.log.warn("status", "Status server not started", port=self.port, error=e)
+            return False
+        # A single thread serves requests one at a time: scrapes are tiny and rare
+        threading.Thread(target=self.httpd.serve_forever, name="status-http", daemon=True).start()
+        self.log.info("status", "Status server listening", host=self.host, port=self.port)
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
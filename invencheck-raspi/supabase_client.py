@@ -0,0 +1,105 @@
+"""
+SupabaseClient class definition
+Shared keep-alive HTTP session for the Supabase REST API (PostgREST)
+
+Damiano Milani
+2025
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SupabaseClient:
+    def __init__(self, url, api_key, pool_size=4, timeout=5):
+        self.base_url = f"{url}/rest/v1"
+        self.timeout = timeout
+        self.request_count = 0
+        self.count_lock = threading.Lock()
+        self.response_hooks = []  # hook(start, end, response), wall-clock times
+        self.error_hooks = []  # hook(start, end, exception) for requests that got no response
+        self.gate = None  # Called before each request, may raise to fail fast
+
+        # One session for the whole daemon: TCP+TLS connections are reused across
+        # calls and threads. The session is never mutated after this point, so it
+        # can be shared safely (urllib3's pool is thread-safe).
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+
+    def request(self, method, path="", params=None, json=None, headers=None, timeout=None, bypass_gate=False):
+        if self.gate is not None and not bypass_gate:
+            self.gate()
+        with self.count_lock:
+            self.request_count += 1
+        start = time.time()
+        try:
+            response = self.session.request(
+                method,
+                f"{self.base_url}/{path}",
+                params=params,
+                json=json,
+                headers=headers,
+                timeout=timeout or self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            end = time.time()
+            for hook in self.error_hooks:
+                hook(start, end, e)
+            raise
+        end = time.time()
+        for hook in self.response_hooks:
+            hook(start, end, response)
+        return response
+
+    @staticmethod
+    def error_code(response):
+        """PostgREST/Postgres error code of a failed response (e.g. "PGRST204", "42P10"), or None."""
+        try:
+            body = response.json()
+        except ValueError:
+            return None
+        return body.get("code") if isinstance(body, dict) else None
+
+    @staticmethod
+    def _prefer(returning):
+        return {"Prefer": "return=representation" if returning else "return=minimal"}
+
+    def select(self, table, columns="*", filters=None, order=None, limit=None, timeout=None):
+        """filters is a dict of PostgREST operators, e.g. {"uid": "eq.04A1B2"}."""
+        params = {"select": columns}
+        params.update(filters or {})
+        if order:
+            params["order"] = order
+        if limit is not None:
+            params["limit"] = limit
+        return self.request("GET", table, params=params, timeout=timeout)
+
+    def insert(self, table, rows, returning=False, timeout=None):
+        return self.request("POST", table, json=rows, headers=self._prefer(returning), timeout=timeout)
+
+    def upsert(self, table, rows, on_conflict, returning=False, timeout=None, ignore_duplicates=False):
+        """
+        Insert or merge into the row matching on_conflict, in a single request.
+        With ignore_duplicates rows matching an existing one are skipped instead.
+        """
+        headers = self._prefer(returning)
+        headers["Prefer"] += ",resolution=ignore-duplicates" if ignore_duplicates else ",resolution=merge-duplicates"
+        return self.request("POST", table, params={"on_conflict": on_conflict}, json=rows, headers=headers, timeout=timeout)
+
+    def update(self, table, filters, values, returning=False, timeout=None):
+        return self.request("PATCH", table, params=filters, json=values, headers=self._prefer(returning), timeout=timeout)
+
+    def delete(self, table, filters, returning=False, timeout=None):
+        return self.request("DELETE", table, params=filters, headers=self._prefer(returning), timeout=timeout)
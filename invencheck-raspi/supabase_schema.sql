@@ -0,0 +1,40 @@
+-- InvenCheck - Supabase schema migration
+-- Columns and constraints used by the daemon on top of the original tables.
+-- Safe to run more than once (SQL editor of the Supabase project).
+--
+-- Damiano Milani
+-- 2025
+
+-- Heartbeat: one row per device, upserted with on_conflict=device_id and
+-- carrying the health snapshot of the device.
+alter table public.devices add column if not exists telemetry jsonb;
+
+-- Keep the most recent row (latest heartbeat timestamp, rows without one count as
+-- oldest, physical order breaks ties) of any duplicated device_id before adding the constraint
+delete from public.devices a
+    using public.devices b
+    where a.device_id = b.device_id
+      and (a.timestamp < b.timestamp
+           or (a.timestamp is null and b.timestamp is not null)
+           or (a.timestamp is not distinct from b.timestamp and a.ctid < b.ctid));
+create unique index if not exists devices_device_id_key on public.devices (device_id);
+
+-- Reader lane (NFC_READERS name) of attendance rows written by multi-reader devices;
+-- device_id stays the device itself so that its devices row still gives the place.
+alter table public.attendance add column if not exists lane text;
+
+-- Client-generated id of every attendance row (outbox row UUID): the daemon upserts
+-- on it with resolution=ignore-duplicates, so a batch retried after a lost response
+-- does not insert the same scans twice. Rows written before have it null.
+alter table public.attendance add column if not exists client_id uuid;
+create unique index if not exists attendance_client_id_key on public.attendance (client_id);
+
+-- Bulk ledger prefetch (latest action per user since local midnight) and delta syncs
+create index if not exists attendance_user_id_timestamp_idx on public.attendance (user_id, timestamp desc);
+create index if not exists attendance_timestamp_idx on public.attendance (timestamp);
+
+-- Roster delta sync
+create index if not exists users_timestamp_idx on public.users (timestamp);
+
+-- Reload the PostgREST schema cache so the new column is visible right away
+notify pgrst, 'reload schema';
@@ -0,0 +1,471 @@
+"""
+Supabase stand-in
+Local PostgREST-compatible server backed by SQLite, implementing the subset of
+the REST API used by the daemon and the diagnostic scripts, with fault injection
+(latency distributions, error rates, hung requests, dropped connections and
+Date-header skew) for deterministic offline, retry, clock and batching tests.
+
+    python supabase_standin.py --port 54321 --latency lognormal:40:0.5 --error-rate 0.02
+    SUPABASE_URL=http://127.0.0.1:54321 python InvenCheck_main.py
+
+Damiano Milani
+2025
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+# Tables used by InvenCheck, with their conflict targets. Columns are TEXT unless noted.
+SCHEMA = {
+    "users": {
+        "columns": {"uid": "TEXT PRIMARY KEY", "user_id": "TEXT", "timestamp": "TEXT"},
+        "timestamps": ("timestamp",),
+    },
+    "attendance": {
+        "columns": {"id": "INTEGER PRIMARY KEY AUTOINCREMENT", "user_id": "TEXT", "action": "TEXT",
+                    "timestamp": "TEXT", "device_id": "TEXT", "lane": "TEXT", "client_id": "TEXT UNIQUE"},
+        "timestamps": ("timestamp",),
+    },
+    "devices": {
+        "columns": {"device_id": "TEXT PRIMARY KEY", "timestamp": "TEXT", "ip": "TEXT", "telemetry": "JSON"},
+        "timestamps": ("timestamp",),
+    },
+}
+
+OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.body = {"code": code, "message": message, "details": None, "hint": None}
+
+
+def normalize_timestamp(value):
+    """timestamptz as PostgREST returns it, so that stored values compare as strings."""
+    if value is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00").replace(" ", "+"))
+    except ValueError:
+        raise ApiError(400, "22007", f'invalid input syntax for type timestamp with time zone: "{value}"')
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def latency_sampler(spec, rng):
+    """
+    Seconds of added latency from a spec in milliseconds: "0", "const:30",
+    "uniform:10:80", "normal:50:10", "exp:40" (mean) or "lognormal:40:0.5" (median, sigma).
+    """
+    parts = str(spec or "0").split(":")
+    kind, params = (parts[0], [float(p) for p in parts[1:]]) if len(parts) > 1 else ("const", [float(parts[0])])
+    if kind == "const":
+        return lambda: params[0] / 1000
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, rng.gauss(params[0], params[1])) / 1000
+    if kind == "exp":
+        return lambda: rng.expovariate(1.0 / params[0]) / 1000
+    if kind == "lognormal":
+        import math
+        return lambda: rng.lognormvariate(math.log(params[0]), params[1]) / 1000
+    raise ValueError(f"Unknown latency distribution '{kind}'")
+
+
+class Faults:
+    def __init__(self, latency="0", error_rate=0.0, error_status=503, timeout_rate=0.0, hang=30.0,
+                 drop_rate=0.0, offline=False, date_skew=0.0, seed=None):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.update(latency=latency, error_rate=error_rate, error_status=error_status, timeout_rate=timeout_rate,
+                    hang=hang, drop_rate=drop_rate, offline=offline, date_skew=date_skew)
+
+    def update(self, **settings):
+        with self.lock:
+            for key, value in settings.items():
+                setattr(self, key, value)
+            self.sample_latency = latency_sampler(self.latency, self.rng)
+
+    def settings(self):
+        with self.lock:
+            return {key: getattr(self, key) for key in
+                    ("latency", "error_rate", "error_status", "timeout_rate", "hang", "drop_rate", "offline", "date_skew")}
+
+    def draw(self):
+        """(action, latency) for the next request: action is None, "drop", "hang" or "error"."""
+        with self.lock:
+            if self.offline or self.rng.random() < self.drop_rate:
+                return "drop", 0.0
+            latency = self.sample_latency()
+            roll = self.rng.random()
+            if roll < self.timeout_rate:
+                return "hang", self.hang
+            if roll < self.timeout_rate + self.error_rate:
+                return "error", latency
+            return None, latency
+
+
+class Database:
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for table, spec in SCHEMA.items():
+            columns = ", ".join(f'"{name}" {"TEXT" if kind == "JSON" else kind}' for name, kind in spec["columns"].items())
+            self.db.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+
+    @staticmethod
+    def _table(table):
+        if table not in SCHEMA:
+            raise ApiError(404, "42P01", f'relation "public.{table}" does not exist')
+        return SCHEMA[table]
+
+    @staticmethod
+    def _column(spec, table, column):
+        if column not in spec["columns"]:
+            raise ApiError(400, "42703", f"column {table}.{column} does not exist")
+        return f'"{column}"'
+
+    def _where(self, table, filters):
+        spec = self._table(table)
+        clauses, values = [], []
+        for column, expression in filters:
+            name = self._column(spec, table, column)
+            negate = expression.startswith("not.")
+            if negate:
+                expression = expression[4:]
+            operator, _, value = expression.partition(".")
+            if operator == "is":
+                clause = f"{name} IS {'NULL' if value == 'null' else ('1' if value == 'true' else '0')}"
+            elif operator == "in":
+                items = [item.strip().strip('"') for item in value.strip("()").split(",") if item.strip()]
+                if column in spec["timestamps"]:
+                    items = [normalize_timestamp(item) for item in items]
+                clause = f"{name} IN ({', '.join('?' for _ in items)})"
+                values.extend(items)
+            elif operator in OPERATORS:
+                if column in spec["timestamps"]:
+                    value = normalize_timestamp(value)
+                elif operator in ("like", "ilike"):
+                    value = value.replace("*", "%")
+                clause = f"{name} {OPERATORS[operator]} ?"
+                if operator == "ilike":
+                    clause = f"LOWER({name}) LIKE LOWER(?)"
+                values.append(value)
+            else:
+                raise ApiError(400, "PGRST100", f'unknown operator "{operator}"')
+            clauses.append(f"NOT ({clause})" if negate else clause)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", values
+
+    def _decode(self, table, rows, columns):
+        json_columns = {name for name, kind in SCHEMA[table]["columns"].items() if kind == "JSON"}
+        result = []
+        for row in rows:
+            item = dict(zip(columns, row))
+            for name in json_columns & item.keys():
+                if item[name] is not None:
+                    item[name] = json.loads(item[name])
+            result.append(item)
+        return result
+
+    def _encode(self, table, row):
+        spec = self._table(table)
+        encoded = {}
+        for column, value in row.items():
+            if column not in spec["columns"]:
+                raise ApiError(400, "PGRST204", f"Could not find the '{column}' column of '{table}' in the schema cache")
+            if spec["columns"][column] == "JSON" and value is not None:
+                value = json.dumps(value)
+            elif column in spec["timestamps"]:
+                value = normalize_timestamp(value)
+            encoded[column] = value
+        return encoded
+
+    def select(self, table, columns, filters, order=None, limit=None, offset=0, count=False):
+        spec = self._table(table)
+        names = list(spec["columns"]) if columns in ("*", "") else [c.strip() for c in columns.split(",")]
+        projection = ", ".join(self._column(spec, table, name) for name in names)
+        where, values = self._where(table, filters)
+        sql = f'SELECT {projection} FROM "{table}"{where}'
+        if order:
+            terms = []
+            for term in order.split(","):
+                column, *modifiers = term.split(".")
+                direction = "DESC" if "desc" in modifiers else "ASC"
+                nulls = " NULLS FIRST" if "nullsfirst" in modifiers else (" NULLS LAST" if "nullslast" in modifiers else "")
+                terms.append(f"{self._column(spec, table, column)} {direction}{nulls}")
+            sql += " ORDER BY " + ", ".join(terms)
+        if limit is not None or offset:
+            sql += f" LIMIT {int(limit) if limit is not None else -1} OFFSET {int(offset)}"
+        with self.lock:
+            rows = self.db.execute(sql, values).fetchall()
+            total = self.db.execute(f'SELECT COUNT(*) FROM "{table}"{where}', values).fetchone()[0] if count else None
+        return self._decode(table, rows, names), total
+
+    def insert(self, table, rows, on_conflict=None, merge=False, ignore=False):
+        self._table(table)
+        inserted = []
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                for row in rows:
+                    encoded = self._encode(table, row)
+                    columns = ", ".join(f'"{c}"' for c in encoded)
+                    placeholders = ", ".join("?" for _ in encoded)
+                    sql = f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders})'
+                    if on_conflict and (merge or ignore):
+                        target = self._column(SCHEMA[table], table, on_conflict)
+                        updates = ", ".join(f'"{c}" = excluded."{c}"' for c in encoded if c != on_conflict)
+                        if merge and updates:
+                            sql += f" ON CONFLICT({target}) DO UPDATE SET {updates}"
+                        else:
+                            sql += f" ON CONFLICT({target}) DO NOTHING"
+                    sql += " RETURNING *"
+                    cursor = self.db.execute(sql, list(encoded.values()))
+                    returned = cursor.fetchall()
+                    inserted.extend(self._decode(table, returned, [d[0] for d in cursor.description]))
+                self.db.execute("COMMIT")
+            except sqlite3.IntegrityError as e:
+                self.db.execute("ROLLBACK")
+                raise ApiError(409, "23505", f"duplicate key value violates unique constraint ({e})")
+            except sqlite3.OperationalError as e:
+                self.db.execute("ROLLBACK")
+                if "ON CONFLICT" in str(e):
+                    raise ApiError(400, "42P10", "there is no unique or exclusion constraint matching the ON CONFLICT specification")
+                raise
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def update(self, table, filters, values):
+        encoded = self._encode(table, values)
+        if not encoded:
+            return []
+        where, params = self._where(table, filters)
+        assignments = ", ".join(f'"{c}" = ?' for c in encoded)
+        with self.lock:
+            cursor = self.db.execute(f'UPDATE "{table}" SET {assignments}{where} RETURNING *',
+                                     list(encoded.values()) + params)
+            rows = cursor.fetchall()
+        return self._decode(table, rows, [d[0] for d in cursor.description])
+
+    def delete(self, table, filters):
+        self._table(table)
+        where, params = self._where(table, filters)
+        with self.lock:
+            cursor = self.db.execute(f'DELETE FROM "{table}"{where} RETURNING *', params)
+            rows = cursor.fetchall()
+        return self._decode(table, rows, [d[0] for d in cursor.description])
+
+
+class SupabaseStandIn:
+    def __init__(self, host="127.0.0.1", port=0, db_path=":memory:", api_key=None, faults=None):
+        """port=0 picks a free port; the URL to use as SUPABASE_URL is in self.url after start()."""
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.db = Database(db_path)
+        self.faults = faults or Faults()
+        self.stats_lock = threading.Lock()
+        self.stats = {}  # "METHOD table" -> count, faults included
+        self.httpd = None
+        self.url = None
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def start(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real service
+
+            def log_message(self, format, *args):
+                pass
+
+            def date_time_string(self, timestamp=None):
+                skew = standin.faults.date_skew
+                return formatdate((timestamp or time.time()) + skew, usegmt=True)
+
+            def _reply(self, status, body=None, headers=None):
+                data = b"" if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                if body is not None:
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return None
+                try:
+                    return json.loads(self.rfile.read(length))
+                except ValueError:
+                    raise ApiError(400, "PGRST102", "Empty or invalid json")
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                if url.path == "/__faults":
+                    return self._admin(method)
+                if not url.path.startswith("/rest/v1"):
+                    return self._reply(404, {"message": "not found"})
+                table = url.path[len("/rest/v1"):].strip("/")
+                standin.count(f"{method} {table or '/'}")
+                # Read the body before faults are applied, so keep-alive framing stays intact
+                body = self._body() if method in ("POST", "PATCH") else None
+
+                action, latency = standin.faults.draw()
+                if action == "drop":
+                    self.close_connection = True
+                    return
+                time.sleep(latency)
+                if action == "hang":
+                    self.close_connection = True
+                    return
+                if action == "error":
+                    status = standin.faults.error_status
+                    return self._reply(status, {"code": "PGRST000", "message": f"injected error {status}"})
+
+                if standin.api_key and self.headers.get("apikey") != standin.api_key:
+                    return self._reply(401, {"message": "Invalid API key"})
+                if not table:
+                    return self._reply(200, {"swagger": "2.0", "info": {"title": "InvenCheck stand-in"}})
+                try:
+                    self._dispatch(method, table, url.query, body)
+                except ApiError as e:
+                    self._reply(e.status, e.body)
+                except sqlite3.Error as e:
+                    self._reply(400, {"code": "PGRST000", "message": str(e)})
+
+            def _dispatch(self, method, table, query, body):
+                params = parse_qsl(query, keep_blank_values=True)
+                reserved = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+                options = {key: value for key, value in params if key in reserved}
+                filters = [(key, value) for key, value in params if key not in reserved]
+                prefer = {item.strip() for item in self.headers.get("Prefer", "").split(",")}
+                representation = "return=representation" in prefer
+
+                if method in ("GET", "HEAD"):
+                    offset = int(options.get("offset", 0))
+                    limit = options.get("limit")
+                    range_header = self.headers.get("Range")
+                    if range_header:
+                        start, _, end = range_header.partition("-")
+                        offset = int(start)
+                        if end:
+                            limit = int(end) - offset + 1 if limit is None else min(int(limit), int(end) - offset + 1)
+                    count = "count=exact" in prefer
+                    rows, total = standin.db.select(table, options.get("select", "*"), filters,
+                                                    options.get("order"), limit, offset, count)
+                    last = offset + len(rows) - 1
+                    content_range = f"{offset}-{last}" if rows else "*"
+                    content_range += f"/{total}" if count else "/*"
+                    status = 206 if range_header and count and total is not None and last + 1 < total else 200
+                    return self._reply(status, rows, {"Content-Range": content_range})
+
+                if method == "POST":
+                    rows = body if isinstance(body, list) else [body or {}]
+                    merge = "resolution=merge-duplicates" in prefer
+                    ignore = "resolution=ignore-duplicates" in prefer
+                    on_conflict = options.get("on_conflict")
+                    if (merge or ignore) and not on_conflict:
+                        on_conflict = next(name for name, kind in SCHEMA.get(table, {"columns": {"": "PRIMARY KEY"}})["columns"].items() if "PRIMARY KEY" in kind)
+                    inserted = standin.db.insert(table, rows, on_conflict, merge, ignore)
+                    return self._reply(201, inserted if representation else None)
+
+                if method == "PATCH":
+                    updated = standin.db.update(table, filters, body or {})
+                    return self._reply(200, updated) if representation else self._reply(204)
+
+                if method == "DELETE":
+                    deleted = standin.db.delete(table, filters)
+                    return self._reply(200, deleted) if representation else self._reply(204)
+
+                self._reply(405, {"message": f"{method} not allowed"})
+
+            def _admin(self, method):
+                # GET shows the fault settings and request counts, POST {"error_rate": 0.5, ...} changes them
+                if method == "POST":
+                    standin.faults.update(**(self._body() or {}))
+                with standin.stats_lock:
+                    stats = dict(standin.stats)
+                self._reply(200, {"faults": standin.faults.settings(), "requests": stats})
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_HEAD(self):
+                self._handle("HEAD")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://{self.host}:{self.port}"
+        threading.Thread(target=self.httpd.serve_forever, name="supabase-standin", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", default="0", help="Latency distribution in ms, e.g. lognormal:40:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests left hanging")
+    parser.add_argument("--hang", type=float, default=30.0, help="Seconds a hanging request is held open")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of connections closed without reply")
+    parser.add_argument("--skew", type=float, default=0.0, help="Seconds added to the Date header")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible faults")
+
+
+def faults_from_args(args):
+    return Faults(latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                  timeout_rate=args.timeout_rate, hang=args.hang, drop_rate=args.drop_rate,
+                  date_skew=args.skew, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local PostgREST-compatible Supabase stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--db", default=":memory:", help="SQLite database file")
+    parser.add_argument("--api-key", default=None, help="Require this apikey header")
+    add_arguments(parser)
+    args = parser.parse_args()
+    standin = SupabaseStandIn(args.host, args.port, args.db, args.api_key, faults_from_args(args))
+    print(f"[INIT] Supabase stand-in on {standin.start()} (faults: {standin.faults.settings()})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standin.stop()
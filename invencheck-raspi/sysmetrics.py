@@ -0,0 +1,223 @@
+"""
+SystemSampler class definition
+Background sampler of system metrics read straight from /proc and /sys
+
+Damiano Milani
+2025
+"""
+
+import array
+import fcntl
+import os
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from eventlog import EventLog
+
+SIOCGIFADDR = 0x8915
+SIOCGIWESSID = 0x8B1B
+IW_ESSID_MAX_SIZE = 32
+
+
+def read_git_revision():
+    """Hash and commit date of the checkout, read once at startup."""
+    try:
+        repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        git_hash = subprocess.check_output(['git', '-C', repo_dir, 'rev-parse', 'HEAD'], text=True).strip()[:7]
+        git_raw_date = subprocess.check_output(['git', '-C', repo_dir, 'log', '-1', '--format=%cd'], text=True).strip()
+        git_date = datetime.strptime(git_raw_date, '%a %b %d %H:%M:%S %Y %z').strftime('%d%b%y')
+        return git_hash, git_date
+    except Exception:
+        return "no-git", "unknown"
+
+
+class SystemSampler:
+    def __init__(self, interfaces=("wlan0", "wlan1"), interval=5, history=120, ssid_interval=30, log=None):
+        self.log = log or EventLog()
+        self.interfaces = interfaces
+        self.interval = interval
+        self.ssid_interval = ssid_interval
+        self.history = deque(maxlen=history)  # (time, cpu %, mem %, temp C)
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.git_hash, self.git_date = read_git_revision()
+        self.prev_cpu = None
+        self.last_ssid_sample = 0
+        self.ssids = {iface: "Unknown" for iface in interfaces}
+        self.latest = {}
+        self.started = False
+        self.sample()
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._loop, name="sysmetrics", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                self.log.warn("sysmetrics", "System sampler error", error=e)
+
+    # --- Readers ---
+    def _cpu_percent(self):
+        with open("/proc/stat", "r") as f:
+            fields = [int(x) for x in f.readline().split()[1:]]
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        total = sum(fields)
+        prev, self.prev_cpu = self.prev_cpu, (idle, total)
+        if prev is None:
+            return 100.0 * (1 - idle / total) if total else 0.0
+        d_idle, d_total = idle - prev[0], total - prev[1]
+        return 100.0 * (1 - d_idle / d_total) if d_total else 0.0
+
+    @staticmethod
+    def _mem_percent():
+        info = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                info[key] = int(value.split()[0])
+        total = info.get("MemTotal", 0)
+        available = info.get("MemAvailable", info.get("MemFree", 0))
+        return 100.0 * (total - available) / total if total else 0.0
+
+    @staticmethod
+    def _temperature():
+        try:
+            with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+                return int(f.read().strip()) / 1000.0
+        except Exception:
+            return 0.0
+
+    @staticmethod
+    def _uptime():
+        with open("/proc/uptime", "r") as f:
+            return float(f.read().split()[0])
+
+    def _ip(self, interface):
+        try:
+            packed = fcntl.ioctl(self.sock.fileno(), SIOCGIFADDR, struct.pack('256s', interface.encode()[:15]))
+            return socket.inet_ntoa(packed[20:24])
+        except OSError:
+            return "N/A"
+
+    def _ssid(self, interface):
+        try:
+            buf = array.array('b', b'\0' * (IW_ESSID_MAX_SIZE + 1))
+            address, length = buf.buffer_info()
+            request = struct.pack('16sPHH', interface.encode()[:15], address, length, 0)
+            result = fcntl.ioctl(self.sock.fileno(), SIOCGIWESSID, request)
+            size = struct.unpack('16sPHH', result)[2]
+            return buf.tobytes()[:size].decode(errors="ignore").strip("\0") or "Unknown"
+        except OSError:
+            return "Unknown"
+
+    @staticmethod
+    def _signals():
+        signals = {}
+        try:
+            with open('/proc/net/wireless', 'r') as f:
+                lines = f.readlines()[2:]
+        except OSError:
+            return signals
+        for line in lines:
+            fields = line.replace(':', ' ').split()
+            try:
+                link_quality = float(fields[2].rstrip('.'))
+                level_dbm = int(float(fields[3].rstrip('.')))
+            except (IndexError, ValueError):
+                continue
+            quality_pct = max(0, min(100, int((link_quality / 70.0) * 100)))
+            if quality_pct >= 75:
+                stability = "Stable"
+            elif quality_pct >= 45:
+                stability = "Fair"
+            elif quality_pct > 0:
+                stability = "Weak"
+            else:
+                stability = "NoLink"
+            signals[fields[0]] = (f"{quality_pct}%", f"{level_dbm}dBm", stability)
+        return signals
+
+    def sample(self):
+        now = time.time()
+        cpu = self._cpu_percent()
+        mem = self._mem_percent()
+        temp = self._temperature()
+        # SSIDs rarely change and the ioctl wakes the driver: sample them less often
+        if now - self.last_ssid_sample >= self.ssid_interval:
+            self.ssids = {iface: self._ssid(iface) for iface in self.interfaces}
+            self.last_ssid_sample = now
+        signals = self._signals()
+        interfaces = {
+            iface: {
+                "ssid": self.ssids.get(iface, "Unknown"),
+                "ip": self._ip(iface),
+                "signal": signals.get(iface, ("N/A", "N/A", "Unknown")),
+            }
+            for iface in self.interfaces
+        }
+        with self.lock:
+            self.history.append((now, cpu, mem, temp))
+            self.latest = {
+                "time": now,
+                "cpu": cpu,
+                "mem": mem,
+                "temp": temp,
+                "uptime": self._uptime(),
+                "interfaces": interfaces,
+            }
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.latest)
+
+    def summary(self):
+        """Min, average and max of cpu %, mem % and temp C over the history window."""
+        with self.lock:
+            samples = list(self.history)
+        if not samples:
+            return {}
+        result = {"window_seconds": round(samples[-1][0] - samples[0][0], 1), "samples": len(samples)}
+        for index, name in enumerate(("cpu", "mem", "temp"), start=1):
+            values = [sample[index] for sample in samples]
+            result[name] = {
+                "min": round(min(values), 1),
+                "avg": round(sum(values) / len(values), 1),
+                "max": round(max(values), 1),
+            }
+        return result
+
+    def screens(self):
+        """Diagnostic screens rendered from the cached sample."""
+        hostname = socket.gethostname()
+        latest = self.snapshot()
+        peak = self.summary()
+        uptime_seconds = latest["uptime"]
+        days = int(uptime_seconds // 86400)
+        hours = int((uptime_seconds % 86400) // 3600)
+        minutes = int((uptime_seconds % 3600) // 60)
+
+        screens = [[
+            f"GIT  {self.git_hash} {self.git_date}",
+            f"CPU  {latest['cpu']:.0f}%    MEM  {latest['mem']:.0f}%",
+            f"TEMP {latest['temp']:.1f}C max {peak['temp']['max']:.0f}C" if peak else f"TEMP {latest['temp']:.1f}C",
+            f"UP   {days}d{hours}h{minutes}m",
+        ]]
+        for interface, info in latest["interfaces"].items():
+            quality, level_dbm, stability = info["signal"]
+            screens.append([
+                f"{interface.upper()} {hostname[:13]}",
+                f"SSID {info['ssid'][:15]}",
+                f"IP   {info['ip'][:15]}",
+                f"SIG  {level_dbm} {quality} {stability[:5]}",
+            ])
+        return screens
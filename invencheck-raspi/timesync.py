@@ -0,0 +1,128 @@
+"""
+TimeService class definition
+Server clock offset estimated in the background, with cached local day boundaries
+
+Damiano Milani
+2025
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+import pytz
+
+from eventlog import EventLog
+
+
+class TimeService:
+    def __init__(self, probe=None, timezone_name="Europe/Rome", interval=600, tolerance=30, samples=16, log=None):
+        """
+        probe() performs a request to the server and returns its response; the
+        Date header is read from it. Any other response can be fed to observe().
+        """
+        self.probe = probe
+        self.log = log or EventLog()
+        self.tz = pytz.timezone(timezone_name)
+        self.interval = interval
+        self.tolerance = tolerance
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=samples)  # (offset, rtt)
+        self.offset = 0.0  # server clock minus local wall clock, in seconds
+        self.synced = False
+        # Wall clock anchored to the monotonic clock: a step of the system clock
+        # (e.g. timesyncd after boot) shifts the anchor instead of the offset.
+        self.anchor = time.time() - time.monotonic()
+        self.day_end = 0.0
+        self.day_cutoff = None
+
+    def start(self):
+        threading.Thread(target=self._loop, name="timesync", daemon=True).start()
+
+    def _loop(self):
+        # A few quick samples at startup, then one every interval
+        for _ in range(3):
+            self.sync()
+            time.sleep(2)
+        while True:
+            time.sleep(self.interval)
+            self.sync()
+
+    def sync(self):
+        if self.probe is None:
+            return False
+        try:
+            start = time.time()
+            response = self.probe()
+            end = time.time()
+            return self.observe(start, end, response.headers.get("Date"))
+        except Exception as e:
+            self.log.warn("time", "Failed to refresh server time offset", error=e)
+            return False
+
+    def observe(self, start, end, date_header):
+        """Add a sample from a request sent at start and answered at end (wall clock)."""
+        if not date_header:
+            return False
+        try:
+            server_dt = parsedate_to_datetime(date_header)
+        except (TypeError, ValueError):
+            return False
+        if server_dt is None:
+            return False
+
+        # The Date header is truncated to the second: +0.5 s centres it. The server
+        # stamped it roughly half way through the round trip.
+        self._wall()  # Re-anchor first if the clock stepped, or the step would be applied to this sample too
+        rtt = max(0.0, end - start)
+        offset = server_dt.timestamp() + 0.5 - (start + rtt / 2)
+        with self.lock:
+            first = not self.synced
+            self.samples.append((offset, rtt))
+            # Median of the lowest-latency samples: those carry the least uncertainty
+            best = sorted(self.samples, key=lambda s: s[1])[:5]
+            offsets = sorted(s[0] for s in best)
+            self.offset = offsets[len(offsets) // 2]
+            self.synced = True
+            estimate = self.offset
+        if first:
+            if abs(estimate) > self.tolerance:
+                self.log.warn("time", "Clock offset detected, using server time", offset=round(estimate, 2))
+            else:
+                self.log.info("time", "Clock offset within tolerance", offset=round(estimate, 2))
+        return True
+
+    def _wall(self):
+        now = time.time()
+        step = now - (self.anchor + time.monotonic())
+        if abs(step) > 1.0:
+            # The system clock was stepped. Samples were measured against the old
+            # clock: shift them all with it, or the next median would undo the step.
+            # Before the first sample there is nothing to shift, the new clock is used as is.
+            with self.lock:
+                self.anchor = now - time.monotonic()
+                if self.synced:
+                    self.offset -= step
+                    self.samples = deque(((offset - step, rtt) for offset, rtt in self.samples),
+                                         maxlen=self.samples.maxlen)
+        return now
+
+    def now(self):
+        """Current server-aligned UTC time as a POSIX timestamp. Never blocks on the network."""
+        return self._wall() + self.offset
+
+    def now_utc_iso(self):
+        return datetime.fromtimestamp(self.now(), timezone.utc).replace(tzinfo=None).isoformat(timespec="microseconds")
+
+    def today_cutoff_utc(self):
+        """UTC instant of today's local midnight, recomputed once per local day."""
+        now = self.now()
+        if now >= self.day_end or self.day_cutoff is None:
+            local_date = datetime.fromtimestamp(now, timezone.utc).astimezone(self.tz).date()
+            midnight = self.tz.localize(datetime.combine(local_date, datetime.min.time()))
+            next_midnight = self.tz.localize(datetime.combine(local_date + timedelta(days=1), datetime.min.time()))
+            self.day_cutoff = midnight.astimezone(pytz.utc).isoformat().replace("+00:00", "Z")
+            self.day_end = next_midnight.timestamp()
+        return self.day_cutoff
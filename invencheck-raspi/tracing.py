@@ -0,0 +1,96 @@
+"""
+TraceRecorder class definition
+Scan traces as JSON lines (hashed UID, arrival time, outcome, per-stage
+latencies), buffered in memory and appended to disk in batches
+
+Damiano Milani
+2025
+"""
+
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import deque
+
+from eventlog import EventLog
+
+
+def hash_uid(uid, salt):
+    """Stable pseudonym of a tag: UIDs are short enough to brute-force an unsalted hash."""
+    return hashlib.sha256(f"{salt}:{uid}".encode()).hexdigest()[:16]
+
+
+def load_trace(path):
+    """Trace records sorted by arrival time."""
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["arrival"])
+    return records
+
+
+class TraceRecorder:
+    def __init__(self, path, salt=None, flush_interval=5, capacity=10000, log=None):
+        """
+        The salt is kept next to the trace (path + ".salt") unless given, so a
+        tag keeps the same pseudonym across restarts of the daemon.
+        """
+        self.path = path
+        self.log = log or EventLog()
+        self.salt = salt if salt is not None else self._load_salt(f"{path}.salt")
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = deque(maxlen=capacity)
+        self.started = False
+
+    @staticmethod
+    def _load_salt(salt_path):
+        try:
+            with open(salt_path, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            salt = secrets.token_hex(16)
+            with open(salt_path, "w") as f:
+                f.write(salt)
+            return salt
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._flusher_loop, name="trace", daemon=True).start()
+
+    def record(self, uid, detected_at, outcome, stages=None, total=None):
+        """detected_at is the monotonic time of the read; stage and total durations are in seconds."""
+        arrival = time.time() - (time.monotonic() - detected_at)
+        entry = {
+            "uid": hash_uid(uid, self.salt),
+            "arrival": round(arrival, 4),
+            "outcome": outcome,
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in (stages or {}).items()},
+        }
+        if total is not None:
+            entry["total_ms"] = round(total * 1000, 3)
+        with self.lock:
+            self.pending.append(entry)
+
+    def flush(self):
+        with self.lock:
+            entries = list(self.pending)
+            self.pending.clear()
+        if not entries:
+            return
+        try:
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        except OSError as e:
+            self.log.warn("trace", "Failed to write scan trace", error=e)
+
+    def _flusher_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()